@@ -2,30 +2,63 @@
 Configuration settings for the OMR Evaluator system.
 """
 import os
-from typing import Optional
+import re
+from functools import cache
+from typing import NamedTuple, Optional
+
+@cache
+def _load_env() -> dict:
+    """Load .env once per process and snapshot the resulting environment"""
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.environ.copy()
+
+_env = _load_env()
+
+@cache
+def _abspath(path: str) -> str:
+    """os.path.abspath memoized for constant setting paths"""
+    return os.path.abspath(path)
+
+DEFAULT_SECRET_KEY = "your-secret-key-here-change-in-production"
+
+class Settings(NamedTuple):
+    """Application settings (resolved once at import, read-only afterwards)"""
+
+    # Deployment environment (Railway sets RAILWAY_ENVIRONMENT)
+    ENVIRONMENT: str = _env.get("ENVIRONMENT") or _env.get("RAILWAY_ENVIRONMENT", "development")
+    LOG_LEVEL: str = _env.get("LOG_LEVEL", "INFO").upper()
 
-class Settings:
-    """Application settings"""
-    
     # Database settings
-    DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./omr_evaluator.db")
-    
+    DATABASE_URL: str = _env.get("DATABASE_URL", "sqlite:///./omr_evaluator.db")
+    DB_POOL_SIZE: int = int(_env.get("DB_POOL_SIZE", "20"))
+    DB_MAX_OVERFLOW: int = int(_env.get("DB_MAX_OVERFLOW", "30"))
+    DB_POOL_TIMEOUT: int = int(_env.get("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(_env.get("DB_POOL_RECYCLE", "3600"))  # keep below the server's wait_timeout
+    DB_POOL_PRE_PING: bool = _env.get("DB_POOL_PRE_PING", "false").lower() == "true"
+
     # JWT settings
-    SECRET_KEY: str = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
-    ALGORITHM: str = "HS256"
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
-    
+    SECRET_KEY: str = _env.get("SECRET_KEY", DEFAULT_SECRET_KEY)
+    ALGORITHM: str = _env.get("JWT_ALGORITHM", "HS256")
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(_env.get("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+
     # File upload settings
     UPLOAD_DIR: str = "uploads"
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
-    ALLOWED_FILE_EXTENSIONS: list = ['.jpg', '.jpeg', '.png', '.pdf']
-    
+    ALLOWED_FILE_EXTENSIONS: frozenset = frozenset({'.jpg', '.jpeg', '.png', '.pdf'})
+
     # OMR Processing settings
-    ALLOW_RESUBMISSION: bool = os.getenv("ALLOW_RESUBMISSION", "true").lower() == "true"
-    REQUIRE_TEACHER_APPROVAL_FOR_RESUBMISSION: bool = os.getenv("REQUIRE_TEACHER_APPROVAL", "false").lower() == "true"
-    
+    OMR_WORKERS: int = int(_env.get("OMR_WORKERS", "0"))  # >0 uses a process pool
+    OMR_MAX_PENDING: int = int(_env.get("OMR_MAX_PENDING", "0"))  # >0 sheds load past this many jobs
+    ALLOW_RESUBMISSION: bool = _env.get("ALLOW_RESUBMISSION", "true").lower() == "true"
+    REQUIRE_TEACHER_APPROVAL_FOR_RESUBMISSION: bool = _env.get("REQUIRE_TEACHER_APPROVAL", "false").lower() == "true"
+
+    # Response cache (Redis when REDIS_URL is set, in-process otherwise)
+    REDIS_URL: Optional[str] = _env.get("REDIS_URL")
+    CACHE_TTL_SECONDS: int = int(_env.get("CACHE_TTL_SECONDS", "60"))
+
     # API settings
-    CORS_ORIGINS: list = [
+    CORS_ORIGINS: tuple = tuple(_v.split(",")) if (_v := _env.get("CORS_ORIGINS")) else (
         "http://localhost:3000",
         "http://127.0.0.1:3000",
         # Current production frontend deployment
@@ -39,12 +72,44 @@ class Settings:
         "https://scanalyze-gamma.vercel.app",
         "https://scanalyze-omr-evaluator.vercel.app",
         "https://markit-omr-evaluator.vercel.app",
-    ] if not os.getenv("CORS_ORIGINS") else os.getenv("CORS_ORIGINS").split(",")
-    
-    @classmethod
-    def get_upload_path(cls) -> str:
+    )
+    # Opt-in pattern for extra origins (e.g. team-scoped Vercel previews,
+    # https://scanalyze-[a-z0-9-]+-<team>\.vercel\.app). Credentials are
+    # allowed, so it must never match hosts other people can register; it
+    # only extends the default list and is ignored when CORS_ORIGINS is set
+    CORS_ORIGIN_REGEX: Optional[str] = None if _env.get("CORS_ORIGINS") else _env.get("CORS_ORIGIN_REGEX")
+    del _v  # keep the class namespace to declared fields only
+
+    def get_upload_path(self) -> str:
         """Get the absolute path for uploads directory"""
-        return os.path.abspath(cls.UPLOAD_DIR)
+        return _abspath(self.UPLOAD_DIR)
 
 # Create global settings instance
-settings = Settings()
\ No newline at end of file
+settings = Settings()
+
+if settings.ENVIRONMENT == "production" and settings.SECRET_KEY == DEFAULT_SECRET_KEY:
+    raise RuntimeError("SECRET_KEY must be set in production")
+
+# Module-level aliases for hot-path reads (JWT validation, upload handling)
+LOG_LEVEL = settings.LOG_LEVEL
+DATABASE_URL = settings.DATABASE_URL
+DB_POOL_SIZE = settings.DB_POOL_SIZE
+DB_MAX_OVERFLOW = settings.DB_MAX_OVERFLOW
+DB_POOL_TIMEOUT = settings.DB_POOL_TIMEOUT
+DB_POOL_RECYCLE = settings.DB_POOL_RECYCLE
+DB_POOL_PRE_PING = settings.DB_POOL_PRE_PING
+SECRET_KEY = settings.SECRET_KEY
+SECRET_KEY_BYTES = SECRET_KEY.encode("utf-8")  # pre-encoded for JWT signing
+ALGORITHM = settings.ALGORITHM
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+UPLOAD_DIR = settings.UPLOAD_DIR
+MAX_FILE_SIZE = settings.MAX_FILE_SIZE
+ALLOWED_FILE_EXTENSIONS = settings.ALLOWED_FILE_EXTENSIONS
+ALLOW_RESUBMISSION = settings.ALLOW_RESUBMISSION
+OMR_WORKERS = settings.OMR_WORKERS
+OMR_MAX_PENDING = settings.OMR_MAX_PENDING
+REDIS_URL = settings.REDIS_URL
+CACHE_TTL_SECONDS = settings.CACHE_TTL_SECONDS
+CORS_ORIGINS = settings.CORS_ORIGINS
+CORS_ORIGINS_SET = frozenset(CORS_ORIGINS)
+CORS_ORIGIN_REGEX = re.compile(settings.CORS_ORIGIN_REGEX) if settings.CORS_ORIGIN_REGEX else None
@@ -1,65 +1,253 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
-import os
-from dotenv import load_dotenv
+# SQLAlchemy is imported inside the factories below so that importing this
+# module (e.g. for config or pure helpers) does not pay for it up front.
+from functools import cache
+import hashlib
+import importlib.util
+import logging
 
-load_dotenv()
+import orjson
 
-# Database configuration
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./omr_evaluator.db")
+from config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING
+)
 
-# Create engine with appropriate configuration
-if DATABASE_URL.startswith("sqlite"):
+logger = logging.getLogger(__name__)
+
+_engine = None
+
+# Compiled-statement cache shared by every engine variant
+QUERY_CACHE_SIZE = 1200
+
+def _json_dumps(value) -> str:
+    """orjson serializer for JSON columns (drivers expect str, not bytes)"""
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+
+# JSON column (de)serialization for answer keys and student answers
+JSON_CODEC = {"json_serializer": _json_dumps, "json_deserializer": orjson.loads}
+
+def _make_sqlite_engine(url: str):
+    """SQLite engine tuned for concurrent readers"""
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import StaticPool
+
+    sqlite_kwargs = {}
+    if ":memory:" in url or url.rstrip("/").endswith(":"):
+        # In-memory databases live inside one connection, so share it
+        sqlite_kwargs["poolclass"] = StaticPool
     engine = create_engine(
-        DATABASE_URL, 
-        connect_args={"check_same_thread": False}
+        url, 
+        connect_args={"check_same_thread": False},
+        query_cache_size=QUERY_CACHE_SIZE,
+        **JSON_CODEC,
+        future=True,
+        **sqlite_kwargs
     )
-elif DATABASE_URL.startswith("mysql"):
-    # MySQL configuration with connection pooling
-    engine = create_engine(
-        DATABASE_URL,
-        pool_size=10,
-        max_overflow=20,
-        pool_pre_ping=True,
-        pool_recycle=3600,  # MySQL recommended: 1 hour
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers proceed while a writer holds the database
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
+    return engine
+
+def _make_mysql_engine(url: str):
+    """MySQL configuration with connection pooling"""
+    from sqlalchemy import create_engine
+
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        # Recycling below MySQL's wait_timeout avoids stale connections
+        # without paying a SELECT 1 round-trip on every checkout
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,  # MySQL recommended: 1 hour
         connect_args={
             "charset": "utf8mb4",
             "autocommit": False
         },
+        query_cache_size=QUERY_CACHE_SIZE,
+        **JSON_CODEC,
+        future=True,
         echo=False  # Set to True for SQL debugging
     )
-else:
-    # Generic database configuration (fallback for other databases)
-    engine = create_engine(
-        DATABASE_URL,
-        pool_size=10,
-        max_overflow=20,
-        pool_pre_ping=True,
-        pool_recycle=300,
+
+def _make_postgres_engine(url: str):
+    """PostgreSQL configuration; tags connections for pg_stat_activity"""
+    from sqlalchemy import create_engine
+
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,
+        connect_args={"application_name": "omr-evaluator"},
+        query_cache_size=QUERY_CACHE_SIZE,
+        **JSON_CODEC,
+        future=True,
         echo=False  # Set to True for SQL debugging
     )
 
-# Create SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _make_generic_engine(url: str):
+    """Generic database configuration (fallback for other databases)"""
+    from sqlalchemy import create_engine
+
+    return create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_recycle=DB_POOL_RECYCLE,
+        query_cache_size=QUERY_CACHE_SIZE,
+        **JSON_CODEC,
+        future=True,
+        echo=False  # Set to True for SQL debugging
+    )
+
+# Engine factory per URL scheme, ignoring the "+driver" suffix
+DIALECT_FACTORIES = {
+    "sqlite": _make_sqlite_engine,
+    "mysql": _make_mysql_engine,
+    "postgresql": _make_postgres_engine,
+}
+
+def _build_engine(url: str):
+    """Create engine with appropriate configuration"""
+    dialect = url.split("://", 1)[0].split("+", 1)[0]
+    return DIALECT_FACTORIES.get(dialect, _make_generic_engine)(url)
 
-# Create Base class
-Base = declarative_base()
+def _prefer_c_mysql_driver(url: str) -> str:
+    """Use the mysqlclient C driver instead of PyMySQL when it is installed."""
+    if url.startswith("mysql+pymysql://") and importlib.util.find_spec("MySQLdb") is not None:
+        return url.replace("mysql+pymysql://", "mysql+mysqldb://", 1)
+    return url
+
+def get_engine():
+    """Return the shared engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        _engine = _build_engine(_prefer_c_mysql_driver(DATABASE_URL))
+    return _engine
+
+# Create SessionLocal class lazily, bound to the shared engine
+@cache
+def _session_local():
+    from sqlalchemy.orm import sessionmaker
+    # Keep loaded state after commit: handlers return the objects they just
+    # wrote, and defaults/ids are populated on flush, so no reload is needed
+    return sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=get_engine())
+
+# Create Base class shared by all models, on first access (PEP 562)
+@cache
+def _lazy_base():
+    from sqlalchemy.orm import DeclarativeBase
+
+    class Base(DeclarativeBase):
+        pass
+
+    return Base
+
+def __getattr__(name: str):
+    if name == "Base":
+        return _lazy_base()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Dependency to get database session
 def get_db():
-    db = SessionLocal()
-    try:
+    with _session_local()() as db:
         yield db
-    finally:
-        db.close()
 
-# Create tables
-def create_tables():
+# Single-row table recording the fingerprint of the last created schema
+@cache
+def _schema_meta_table():
+    from sqlalchemy import MetaData, Table, Column, String
+
+    return Table(
+        "schema_meta", MetaData(),
+        Column("hash", String(32), nullable=False),
+    )
+
+def _schema_fingerprint(metadata) -> str:
+    """Hash of table, column and index names, used to detect model changes"""
+    shape = sorted(
+        (
+            table.name,
+            tuple(column.name for column in table.columns),
+            tuple(sorted(index.name for index in table.indexes)),
+        )
+        for table in metadata.tables.values()
+    )
+    return hashlib.md5(str(shape).encode(), usedforsecurity=False).hexdigest()
+
+def _stored_fingerprint(engine):
+    from sqlalchemy import select
+    from sqlalchemy.exc import SQLAlchemyError
+
+    schema_meta = _schema_meta_table()
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(schema_meta.c.hash)).scalar()
+    except SQLAlchemyError:
+        # schema_meta does not exist yet (fresh database)
+        return None
+
+def _add_missing_columns(engine, metadata) -> None:
+    """Add new nullable columns to tables that already exist."""
+    from sqlalchemy import inspect, text
+    from sqlalchemy.schema import CreateColumn
+
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present or not column.nullable:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"))
+                logger.info("Added column %s.%s", table.name, column.name)
+
+# Create tables (skipped when the stored fingerprint matches the models).
+# This only adds missing tables, nullable columns and indexes; other
+# column changes still need a migration.
+def create_tables() -> bool:
+    from sqlalchemy import delete, insert
     from models import Base
+
+    schema_meta = _schema_meta_table()
+    engine = get_engine()
+    fingerprint = _schema_fingerprint(Base.metadata)
+    if _stored_fingerprint(engine) == fingerprint:
+        return False
+    _add_missing_columns(engine, Base.metadata)
     Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already existed
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    schema_meta.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(delete(schema_meta))
+        conn.execute(insert(schema_meta).values(hash=fingerprint))
+    return True
 
 # Initialize database
 def init_db():
-    create_tables()
-    print("Database tables created successfully!")
\ No newline at end of file
+    if create_tables():
+        logger.info("Database tables created successfully!")
+    else:
+        logger.debug("Database tables already present, skipping create_all")
\ No newline at end of file
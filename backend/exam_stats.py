@@ -0,0 +1,102 @@
+"""
+Incrementally maintained per-question answer counts for exam statistics.
+
+Result writes adjust the exam's ExamStats row in the same transaction, so
+the statistics endpoint does not rescan every result's answers. The row
+is rebuilt from the results table when it is missing or out of step with
+the exam (answer key edited, exams created before the table existed).
+"""
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import ExamStats, Result
+
+def count_answers(answer_key: dict, question_ids: Sequence[str], student_answers: dict) -> Tuple[List[int], List[int]]:
+    """Per-question (correct, answered) flags for one result."""
+    correct, answered = [], []
+    for q in question_ids:
+        student_ans = student_answers.get(q, "")
+        answered.append(int(student_ans != ""))
+        correct.append(int(student_ans != "" and student_ans == answer_key.get(q, "")))
+    return correct, answered
+
+def apply_result_change(
+    db: Session,
+    exam,
+    question_ids: Sequence[str],
+    removed_answers: Optional[dict] = None,
+    added_answers: Optional[dict] = None
+) -> None:
+    """Move one result's answers out of / into the exam's running counts.
+    
+    Does not commit; call it before the commit that writes the result.
+    """
+    stats = db.query(ExamStats).filter(ExamStats.exam_id == exam.id).with_for_update().first()
+    # No row yet, or counts for another answer-key version: the next
+    # statistics read rebuilds from the results table
+    if stats is None or stats.exam_updated_at != exam.updated_at:
+        return
+    
+    correct = list(stats.question_correct)
+    answered = list(stats.question_answered)
+    total_results = stats.total_results
+    for answers, sign in ((removed_answers, -1), (added_answers, 1)):
+        if answers is None:
+            continue
+        delta_correct, delta_answered = count_answers(exam.answer_key, question_ids, answers)
+        correct = [count + sign * delta for count, delta in zip(correct, delta_correct)]
+        answered = [count + sign * delta for count, delta in zip(answered, delta_answered)]
+        total_results += sign
+    
+    stats.question_correct = correct
+    stats.question_answered = answered
+    stats.total_results = total_results
+
+def rebuild_counts(db: Session, exam, question_ids: Sequence[str]) -> Tuple[int, List[int], List[int]]:
+    """Recount every result's answers for exam (students x questions matrix)."""
+    rows = db.query(Result.student_answers).filter(Result.exam_id == exam.id).all()
+    if not rows:
+        return 0, [0] * len(question_ids), [0] * len(question_ids)
+    
+    key = np.array([exam.answer_key.get(q, "") for q in question_ids])
+    answers = np.array([
+        [student_answers.get(q, "") for q in question_ids]
+        for (student_answers,) in rows
+    ])
+    answered = answers != ""
+    correct_counts = ((answers == key) & answered).sum(axis=0)
+    answered_counts = answered.sum(axis=0)
+    return len(rows), correct_counts.tolist(), answered_counts.tolist()
+
+def get_question_counts(db: Session, exam, question_ids: Sequence[str], total_results: int) -> Tuple[List[int], List[int]]:
+    """Per-question (correct, answered) counts, rebuilding the stored row if stale.
+    
+    total_results is the exam's current result count; a stored row that
+    disagrees with it has missed a write and is recounted.
+    """
+    stats = db.get(ExamStats, exam.id)
+    if (
+        stats is not None
+        and stats.total_results == total_results
+        and stats.exam_updated_at == exam.updated_at
+        and len(stats.question_correct) == len(question_ids)
+    ):
+        return stats.question_correct, stats.question_answered
+    
+    total_results, correct, answered = rebuild_counts(db, exam, question_ids)
+    if stats is None:
+        stats = ExamStats(exam_id=exam.id)
+        db.add(stats)
+    stats.total_results = total_results
+    stats.question_correct = correct
+    stats.question_answered = answered
+    stats.exam_updated_at = exam.updated_at
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another request inserted the row first; its counts are as fresh
+        db.rollback()
+    return correct, answered
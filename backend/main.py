@@ -1,12 +1,21 @@
 from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from sqlalchemy import or_, func, distinct, select, case
+from sqlalchemy.orm import Session, aliased, contains_eager
+from typing import List, Optional, Tuple
 import os
 import uuid
-import shutil
+import logging
+import hashlib
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import aiofiles.os
+import numpy as np
+import orjson
 from datetime import datetime
+from functools import cache
 
 from database import get_db, init_db
 from models import User, Exam, Result, OMRProcessingLog
@@ -20,20 +29,30 @@ from auth import (
     authenticate_user, create_access_token, get_current_active_user,
     require_teacher, require_student, get_password_hash
 )
-from omr_processor import OMRProcessor, validate_omr_format
-from config import settings
+from omr_processor import OMRProcessor, validate_omr_format, init_omr_worker
+import response_cache
+import exam_stats
+from config import (
+    LOG_LEVEL, UPLOAD_DIR, MAX_FILE_SIZE, ALLOWED_FILE_EXTENSIONS, ALLOW_RESUBMISSION, OMR_WORKERS, OMR_MAX_PENDING,
+    CORS_ORIGINS_SET, CORS_ORIGIN_REGEX
+)
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI(
     title="OMR Sheet Evaluator API",
     description="An intelligent OMR processing and evaluation system",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS,
+    allow_origins=CORS_ORIGINS_SET,
+    allow_origin_regex=CORS_ORIGIN_REGEX.pattern if CORS_ORIGIN_REGEX else None,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -42,50 +61,212 @@ app.add_middleware(
 # Initialize OMR processor
 omr_processor = OMRProcessor()
 
+# Optional process pool for CPU-bound OMR work (OMR_WORKERS=0 uses threads)
+omr_executor = ProcessPoolExecutor(
+    max_workers=OMR_WORKERS,
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=init_omr_worker
+) if OMR_WORKERS > 0 else None
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB
+EXAM_CACHE_TTL_SECONDS = 300  # exams change rarely; writes invalidate explicitly
+
 # Create upload directory
-UPLOAD_DIR = settings.UPLOAD_DIR
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+def file_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024 * 1024)}MB"
+    )
+
+def copy_upload(src, file_path: str) -> str:
+    """Copy an upload's spooled file to file_path and return its SHA-256.
+    
+    Blocking; run it in a worker thread. One chunked pass hashes and writes
+    each chunk, stopping as soon as MAX_FILE_SIZE is exceeded.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    src.seek(0)
+    with open(file_path, "wb") as dst:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                raise file_too_large()
+            digest.update(chunk)
+            dst.write(chunk)
+    return digest.hexdigest()
+
+async def save_upload(file: UploadFile, file_path: str) -> str:
+    """Save an uploaded file to disk without blocking the event loop.
+    
+    Enforces MAX_FILE_SIZE and returns the SHA-256 of the content.
+    """
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise file_too_large()
+    return await asyncio.to_thread(copy_upload, file.file, file_path)
+
+def discard_file(path: Optional[str]) -> None:
+    """Delete a stored file if present; other failures are logged, not raised."""
+    if not path:
+        return
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Could not delete file %s: %s", path, e)
+
+async def discard_file_async(path: Optional[str]) -> None:
+    """discard_file without blocking the event loop."""
+    if not path:
+        return
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Could not delete file %s: %s", path, e)
+
+# OMR jobs submitted and not yet finished (only touched on the event loop)
+omr_jobs_in_flight = 0
+
+def check_omr_capacity() -> None:
+    """With OMR_MAX_PENDING set, refuse new work beyond that many queued/running
+    jobs with a 503 instead of letting it wait behind the backlog.
+    
+    Handlers call this before saving an upload, so a shed request costs no
+    disk or hashing work; run_omr checks again since uploads take time.
+    """
+    if OMR_MAX_PENDING and omr_jobs_in_flight >= OMR_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="OMR processing is busy, please try again shortly",
+            headers={"Retry-After": "5"}
+        )
+
+async def run_omr(func, *args):
+    """Run CPU-bound OMR processing off the event loop (see check_omr_capacity)."""
+    global omr_jobs_in_flight
+    check_omr_capacity()
+    
+    omr_jobs_in_flight += 1
+    try:
+        if omr_executor is not None:
+            return await asyncio.get_running_loop().run_in_executor(omr_executor, func, *args)
+        return await asyncio.to_thread(func, *args)
+    finally:
+        omr_jobs_in_flight -= 1
+
+def invalidate_result_caches(exam: ExamSchema, student_id: int) -> None:
+    """Drop cached dashboards/statistics affected by a result write."""
+    response_cache.invalidate(
+        response_cache.dashboard_key(student_id),
+        response_cache.dashboard_key(exam.teacher_id),
+        response_cache.statistics_key(exam.id)
+    )
+
+@cache
+def get_question_ids(total_questions: int) -> Tuple[str, ...]:
+    """Answer-key question IDs ("1".."N") for an exam of total_questions."""
+    return tuple(str(q_num) for q_num in range(1, total_questions + 1))
+
+def get_exam_fresh(db: Session, exam_id: str, active_only: bool = True) -> Optional[ExamSchema]:
+    """Load an exam by its public ID straight from the database.
+    
+    Grading and other reads that feed a write (submission checks and
+    deletes) use this rather than the exam cache: an in-process cache is
+    only invalidated in the worker that handled an update, so a cached
+    exam can be stale for up to EXAM_CACHE_TTL_SECONDS.
+    """
+    db_exam = db.query(Exam).filter(Exam.exam_id == exam_id).first()
+    if not db_exam or (active_only and not db_exam.is_active):
+        return None
+    return ExamSchema.model_validate(db_exam)
+
+def get_exam_cached(db: Session, exam_id: str, active_only: bool = True) -> Optional[ExamSchema]:
+    """Look up an exam by its public ID through the exam cache.
+    
+    Returns a detached ExamSchema snapshot for read-only endpoints; handlers
+    that modify the exam must query the ORM row and call
+    response_cache.invalidate(exam_key), and submission handlers use
+    get_exam_fresh.
+    """
+    cache_key = response_cache.exam_key(exam_id)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        exam = ExamSchema.model_validate_json(cached)
+    else:
+        exam = get_exam_fresh(db, exam_id, active_only=False)
+        if not exam:
+            return None
+        response_cache.put(cache_key, exam.model_dump_json(), ttl=EXAM_CACHE_TTL_SECONDS)
+    
+    if active_only and not exam.is_active:
+        return None
+    return exam
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup."""
     init_db()
-    print("Database initialized successfully!")
+    logger.info("Database initialized successfully!")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop OMR worker processes."""
+    if omr_executor is not None:
+        omr_executor.shutdown(wait=False, cancel_futures=True)
+
+# Handlers that only do blocking DB work (sync SQLAlchemy sessions, bcrypt)
+# are plain `def` so FastAPI runs them in its threadpool instead of
+# stalling the event loop.
 
 # Health check endpoints
+# Pre-serialized bodies for the health endpoints polled by load balancers.
+# A fresh Response is still built per request: middleware (CORS) appends to
+# a response's header list, so a shared instance would accumulate headers.
+ROOT_BODY = orjson.dumps({"message": "OMR Sheet Evaluator API is running", "version": "1.0.0"})
+HEALTH_BODY = orjson.dumps({"status": "healthy", "message": "OMR Sheet Evaluator API is running", "version": "1.0.0"})
+
 @app.get("/", tags=["Health"])
 async def root():
-    return {"message": "OMR Sheet Evaluator API is running", "version": "1.0.0"}
+    return Response(content=ROOT_BODY, media_type="application/json")
 
 @app.get("/health", tags=["Health"])
 async def health():
-    return {"status": "healthy", "message": "OMR Sheet Evaluator API is running", "version": "1.0.0"}
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 # Authentication endpoints
 @app.post("/api/auth/register", response_model=UserSchema, tags=["Authentication"])
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+def register(user: UserCreate, db: Session = Depends(get_db)):
     """Register a new user."""
-    # Check if username already exists
-    if db.query(User).filter(User.username == user.username).first():
+    # Check username, email and (for students) roll number in one query
+    conditions = [User.username == user.username, User.email == user.email]
+    check_roll_number = user.role == "student" and user.roll_number
+    if check_roll_number:
+        conditions.append(User.roll_number == user.roll_number)
+    
+    existing = db.query(User.username, User.email, User.roll_number).filter(or_(*conditions)).all()
+    
+    if any(row.username == user.username for row in existing):
         raise HTTPException(
             status_code=400,
             detail="Username already registered"
         )
     
-    # Check if email already exists
-    if db.query(User).filter(User.email == user.email).first():
+    if any(row.email == user.email for row in existing):
         raise HTTPException(
             status_code=400,
             detail="Email already registered"
         )
     
-    # Check if roll number already exists (for students only)
-    if user.role == "student" and user.roll_number:
-        if db.query(User).filter(User.roll_number == user.roll_number).first():
-            raise HTTPException(
-                status_code=400,
-                detail="Roll number already registered"
-            )
+    if check_roll_number and any(row.roll_number == user.roll_number for row in existing):
+        raise HTTPException(
+            status_code=400,
+            detail="Roll number already registered"
+        )
     
     # Create new user
     hashed_password = get_password_hash(user.password)
@@ -99,12 +280,11 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
     )
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
     
     return db_user
 
 @app.post("/api/auth/login", response_model=Token, tags=["Authentication"])
-async def login(user: UserLogin, db: Session = Depends(get_db)):
+def login(user: UserLogin, db: Session = Depends(get_db)):
     """Authenticate user and return access token."""
     authenticated_user = authenticate_user(db, user.username, user.password)
     if not authenticated_user:
@@ -124,20 +304,20 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 
 # Exam management endpoints (Teacher only)
 @app.post("/api/exams/create", response_model=ExamSchema, tags=["Exams"])
-async def create_exam(
+def create_exam(
     exam: ExamCreate,
     current_user: User = Depends(require_teacher),
     db: Session = Depends(get_db)
 ):
     """Create a new exam (Teacher only)."""
     try:
-        print(f"Creating exam: {exam.exam_id} by teacher ID: {current_user.id}")
+        logger.debug("Creating exam: %s by teacher ID: %s", exam.exam_id, current_user.id)
         
         # Check if exam ID already exists
         if db.query(Exam).filter(Exam.exam_id == exam.exam_id).first():
             raise HTTPException(status_code=400, detail="Exam ID already exists")
         
-        print(f"Exam data: title={exam.title}, questions={exam.total_questions}, choices={exam.number_of_choices}")
+        logger.debug("Exam data: title=%s, questions=%s, choices=%s", exam.title, exam.total_questions, exam.number_of_choices)
         
         db_exam = Exam(
             exam_id=exam.exam_id,
@@ -151,22 +331,20 @@ async def create_exam(
         )
         db.add(db_exam)
         db.commit()
-        db.refresh(db_exam)
+        response_cache.invalidate(response_cache.dashboard_key(current_user.id))
         
-        print(f"Exam created successfully with ID: {db_exam.id}")
+        logger.debug("Exam created successfully with ID: %s", db_exam.id)
         return db_exam
         
     except HTTPException:
         raise  # Re-raise HTTP exceptions as-is
     except Exception as e:
-        print(f"Error creating exam: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error creating exam")
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error creating exam: {str(e)}")
 
 @app.get("/api/exams", response_model=List[ExamSchema], tags=["Exams"])
-async def get_exams(
+def get_exams(
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(get_current_active_user),
@@ -174,7 +352,7 @@ async def get_exams(
 ):
     """Get list of active exams."""
     try:
-        print(f"Getting exams for user: {current_user.username} (role: {current_user.role})")
+        logger.debug("Getting exams for user: %s (role: %s)", current_user.username, current_user.role)
         
         query = db.query(Exam).filter(Exam.is_active == True)
         
@@ -183,26 +361,21 @@ async def get_exams(
             query = query.filter(Exam.teacher_id == current_user.id)
         
         exams = query.offset(skip).limit(limit).all()
-        print(f"Found {len(exams)} exams")
+        logger.debug("Found %d exams", len(exams))
         return exams
         
     except Exception as e:
-        print(f"Error getting exams: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error getting exams")
         raise HTTPException(status_code=500, detail=f"Error retrieving exams: {str(e)}")
 
 @app.get("/api/exams/{exam_id}", response_model=ExamSchema, tags=["Exams"])
-async def get_exam(
+def get_exam(
     exam_id: str,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Get exam details by exam ID."""
-    exam = db.query(Exam).filter(
-        Exam.exam_id == exam_id,
-        Exam.is_active == True
-    ).first()
+    exam = get_exam_cached(db, exam_id)
     
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
@@ -210,7 +383,7 @@ async def get_exam(
     return exam
 
 @app.put("/api/exams/{exam_id}", response_model=ExamSchema, tags=["Exams"])
-async def update_exam(
+def update_exam(
     exam_id: str,
     exam_update: ExamUpdate,
     current_user: User = Depends(require_teacher),
@@ -231,12 +404,16 @@ async def update_exam(
     
     exam.updated_at = datetime.utcnow()
     db.commit()
-    db.refresh(exam)
+    response_cache.invalidate(
+        response_cache.dashboard_key(current_user.id),
+        response_cache.statistics_key(exam.id),
+        response_cache.exam_key(exam_id)
+    )
     
     return exam
 
 @app.delete("/api/exams/{exam_id}", tags=["Exams"])
-async def delete_exam(
+def delete_exam(
     exam_id: str,
     current_user: User = Depends(require_teacher),
     db: Session = Depends(get_db)
@@ -253,22 +430,23 @@ async def delete_exam(
     # Soft delete
     exam.is_active = False
     db.commit()
+    response_cache.invalidate(
+        response_cache.dashboard_key(current_user.id),
+        response_cache.exam_key(exam_id)
+    )
     
     return {"message": "Exam deleted successfully"}
 
 # OMR Processing endpoints
 @app.get("/api/omr/check-submission/{exam_id}", tags=["OMR Processing"])
-async def check_existing_submission(
+def check_existing_submission(
     exam_id: str,
     current_user: User = Depends(require_student),
     db: Session = Depends(get_db)
 ):
     """Check if student has already submitted for this exam."""
-    # Validate exam exists
-    exam = db.query(Exam).filter(
-        Exam.exam_id == exam_id,
-        Exam.is_active == True
-    ).first()
+    # Validate exam exists (fresh: the answer decides whether to upload)
+    exam = get_exam_fresh(db, exam_id)
     
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
@@ -290,17 +468,15 @@ async def check_existing_submission(
     }
 
 @app.delete("/api/omr/submission/{exam_id}", tags=["OMR Processing"])
-async def delete_submission(
+def delete_submission(
     exam_id: str,
     current_user: User = Depends(require_student),
     db: Session = Depends(get_db)
 ):
     """Delete student's submission for an exam."""
-    # Validate exam exists
-    exam = db.query(Exam).filter(
-        Exam.exam_id == exam_id,
-        Exam.is_active == True
-    ).first()
+    # Validate exam exists (fresh: a deactivated or edited exam must not be
+    # served from another worker's cache, and the stats update uses it)
+    exam = get_exam_fresh(db, exam_id)
     
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
@@ -316,16 +492,23 @@ async def delete_submission(
     
     try:
         # Delete the OMR file if it exists
-        if existing_result.omr_file_path and os.path.exists(existing_result.omr_file_path):
-            os.remove(existing_result.omr_file_path)
+        discard_file(existing_result.omr_file_path)
         
         # Delete the result record
         db.delete(existing_result)
         
-        # Also delete any processing logs for this result
-        db.query(OMRProcessingLog).filter(OMRProcessingLog.result_id == existing_result.id).delete()
+        # Also delete any processing logs for this result. No logs are
+        # loaded in this session, so skip the sync pass.
+        db.query(OMRProcessingLog).filter(
+            OMRProcessingLog.result_id == existing_result.id
+        ).delete(synchronize_session=False)
         
+        exam_stats.apply_result_change(
+            db, exam, get_question_ids(exam.total_questions),
+            removed_answers=existing_result.student_answers
+        )
         db.commit()
+        invalidate_result_caches(exam, current_user.id)
         
         return {"message": "Submission deleted successfully"}
         
@@ -336,6 +519,136 @@ async def delete_submission(
             detail=f"Error deleting submission: {str(e)}"
         )
 
+def find_submission(db: Session, exam_id: str, student_id: int) -> Tuple[ExamSchema, Optional[Result]]:
+    """Look up the exam and the student's existing result for an upload (blocking)."""
+    # Fresh from the database: this answer key is what the sheet is graded against
+    exam = get_exam_fresh(db, exam_id)
+    
+    if not exam:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    
+    # Check if student has already submitted for this exam
+    existing_result = db.query(Result).filter(
+        Result.exam_id == exam.id,
+        Result.student_id == student_id
+    ).first()
+    return exam, existing_result
+
+def log_processing_failure(db: Session, file_path: str, processing_result: dict) -> None:
+    """Record a failed OMR run (blocking)."""
+    log_entry = OMRProcessingLog(
+        file_path=file_path,
+        processing_status="failed",
+        error_message=processing_result["message"],
+        processing_time=processing_result["processing_time"]
+    )
+    db.add(log_entry)
+    db.commit()
+
+def save_graded_result(
+    db: Session,
+    exam: ExamSchema,
+    student: User,
+    existing_result: Optional[Result],
+    file_path: str,
+    file_sha256: str,
+    processing_result: dict
+) -> dict:
+    """Grade extracted answers, store the result and its processing log (blocking).
+    
+    Returns the upload response body.
+    """
+    # Calculate results
+    student_answers = processing_result["answers"]
+    answer_key = exam.answer_key
+    correct_answers = sum(
+        1 for q_num, student_ans in student_answers.items()
+        if answer_key.get(q_num) == student_ans
+    )
+    wrong_answers = len(student_answers) - correct_answers
+    
+    unanswered = exam.total_questions - len(student_answers)
+    score = correct_answers  # Assuming 1 mark per question
+    percentage = (correct_answers / exam.total_questions) * 100
+    
+    # Save result to database (replace existing if resubmission)
+    replacing_submission = existing_result is not None
+    previous_answers = existing_result.student_answers if replacing_submission else None
+    if replacing_submission:
+        # Update existing result
+        result = existing_result
+        # Remove old OMR file if it exists
+        discard_file(result.omr_file_path)
+        
+        # Update all fields
+        result.student_answers = student_answers
+        result.correct_answers = correct_answers
+        result.wrong_answers = wrong_answers
+        result.unanswered = unanswered
+        result.score = score
+        result.percentage = percentage
+        result.omr_file_path = file_path
+        result.file_sha256 = file_sha256
+        result.processing_confidence = processing_result["confidence"]
+        result.created_at = datetime.utcnow()  # Update timestamp for resubmission
+    else:
+        # Create new result
+        result = Result(
+            exam_id=exam.id,
+            student_id=student.id,
+            roll_number=student.roll_number,
+            student_answers=student_answers,
+            correct_answers=correct_answers,
+            wrong_answers=wrong_answers,
+            unanswered=unanswered,
+            score=score,
+            percentage=percentage,
+            omr_file_path=file_path,
+            file_sha256=file_sha256,
+            processing_confidence=processing_result["confidence"]
+        )
+        db.add(result)
+    
+    exam_stats.apply_result_change(
+        db, exam, get_question_ids(exam.total_questions),
+        removed_answers=previous_answers, added_answers=student_answers
+    )
+    db.commit()
+    invalidate_result_caches(exam, student.id)
+    
+    # Log successful processing
+    log_entry = OMRProcessingLog(
+        result_id=result.id,
+        file_path=file_path,
+        processing_status="success",
+        processing_time=processing_result["processing_time"],
+        detected_bubbles={"count": processing_result["total_bubbles_detected"]},
+        confidence_scores={"overall": processing_result["confidence"]}
+    )
+    db.add(log_entry)
+    db.commit()
+    
+    # Prepare response message
+    if replacing_submission:
+        message = "OMR sheet resubmitted and processed successfully. Your previous submission has been replaced."
+    else:
+        message = "OMR sheet processed successfully"
+    
+    return {
+        "message": message,
+        "result_id": result.id,
+        "score": score,
+        "percentage": round(percentage, 2),
+        "correct_answers": correct_answers,
+        "wrong_answers": wrong_answers,
+        "unanswered": unanswered,
+        "confidence": processing_result["confidence"],
+        "is_resubmission": replacing_submission
+    }
+
+# The OMR handlers stay async to await the upload copy and OMR run; their
+# blocking DB work goes through asyncio.to_thread instead of the event loop.
+
 @app.post("/api/omr/upload", tags=["OMR Processing"])
 async def upload_omr_sheet(
     exam_id: str = Form(...),
@@ -351,182 +664,90 @@ async def upload_omr_sheet(
             detail="Student must have a roll number assigned to submit OMR sheets"
         )
     
-    # Use the user's roll number
-    roll_number = current_user.roll_number
-    
-    # Validate exam exists
-    exam = db.query(Exam).filter(
-        Exam.exam_id == exam_id,
-        Exam.is_active == True
-    ).first()
-    
-    if not exam:
-        raise HTTPException(status_code=404, detail="Exam not found")
-    
-    # Check if student has already submitted for this exam
-    existing_result = db.query(Result).filter(
-        Result.exam_id == exam.id,
-        Result.student_id == current_user.id
-    ).first()
+    # Validate exam exists and find any existing submission
+    exam, existing_result = await asyncio.to_thread(find_submission, db, exam_id, current_user.id)
     
     # Handle existing submissions
-    allow_resubmission = settings.ALLOW_RESUBMISSION
-    if existing_result and not allow_resubmission:
+    if existing_result and not ALLOW_RESUBMISSION:
         raise HTTPException(
             status_code=400,
             detail="You have already submitted an OMR sheet for this exam"
         )
     
-    # If resubmission is allowed and there's an existing result, we'll replace it
-    replacing_submission = existing_result is not None
-    
     # Validate file format
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file uploaded")
     
     file_extension = os.path.splitext(file.filename)[1].lower()
-    allowed_extensions = settings.ALLOWED_FILE_EXTENSIONS
     
-    if file_extension not in allowed_extensions:
+    if file_extension not in ALLOWED_FILE_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f"File format not supported. Allowed: {', '.join(allowed_extensions)}"
+            detail=f"File format not supported. Allowed: {', '.join(sorted(ALLOWED_FILE_EXTENSIONS))}"
         )
     
+    # Shed load before spending disk and CPU on the upload
+    check_omr_capacity()
+    
     # Generate unique filename
     unique_filename = f"{uuid.uuid4()}{file_extension}"
     file_path = os.path.join(UPLOAD_DIR, unique_filename)
     
     try:
         # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        file_sha256 = await save_upload(file, file_path)
+        
+        # Identical re-upload since the exam last changed: keep the stored
+        # result instead of running the OMR pipeline again
+        if (
+            existing_result
+            and existing_result.file_sha256 == file_sha256
+            and existing_result.created_at
+            and exam.updated_at
+            and existing_result.created_at >= exam.updated_at
+        ):
+            await discard_file_async(file_path)
+            return {
+                "message": "This OMR sheet was already processed. Your existing result has been kept.",
+                "result_id": existing_result.id,
+                "score": existing_result.score,
+                "percentage": round(existing_result.percentage, 2),
+                "correct_answers": existing_result.correct_answers,
+                "wrong_answers": existing_result.wrong_answers,
+                "unanswered": existing_result.unanswered,
+                "confidence": existing_result.processing_confidence,
+                "is_resubmission": True
+            }
         
         # Process OMR sheet
-        processing_result = omr_processor.process_omr_sheet(file_path, exam.total_questions, exam.number_of_choices)
+        processing_result = await run_omr(
+            omr_processor.process_omr_sheet, file_path, exam.total_questions, exam.number_of_choices
+        )
         
         if not processing_result["success"]:
             # Log processing failure
-            log_entry = OMRProcessingLog(
-                file_path=file_path,
-                processing_status="failed",
-                error_message=processing_result["message"],
-                processing_time=processing_result["processing_time"]
-            )
-            db.add(log_entry)
-            db.commit()
+            await asyncio.to_thread(log_processing_failure, db, file_path, processing_result)
             
             raise HTTPException(
                 status_code=400,
                 detail=f"OMR processing failed: {processing_result['message']}"
             )
         
-        # Calculate results
-        student_answers = processing_result["answers"]
-        correct_answers = 0
-        wrong_answers = 0
-        
-        for q_num, student_ans in student_answers.items():
-            if exam.answer_key.get(q_num) == student_ans:
-                correct_answers += 1
-            else:
-                wrong_answers += 1
-        
-        unanswered = exam.total_questions - len(student_answers)
-        score = correct_answers  # Assuming 1 mark per question
-        percentage = (correct_answers / exam.total_questions) * 100
-        
-        # Save result to database (replace existing if resubmission)
-        if replacing_submission:
-            # Update existing result
-            result = existing_result
-            # Remove old OMR file if it exists
-            if result.omr_file_path and os.path.exists(result.omr_file_path):
-                try:
-                    os.remove(result.omr_file_path)
-                except Exception as e:
-                    print(f"Warning: Could not delete old OMR file {result.omr_file_path}: {e}")
-            
-            # Update all fields
-            result.student_answers = student_answers
-            result.correct_answers = correct_answers
-            result.wrong_answers = wrong_answers
-            result.unanswered = unanswered
-            result.score = score
-            result.percentage = percentage
-            result.omr_file_path = file_path
-            result.processing_confidence = processing_result["confidence"]
-            result.created_at = datetime.utcnow()  # Update timestamp for resubmission
-        else:
-            # Create new result
-            result = Result(
-                exam_id=exam.id,
-                student_id=current_user.id,
-                roll_number=roll_number,
-                student_answers=student_answers,
-                correct_answers=correct_answers,
-                wrong_answers=wrong_answers,
-                unanswered=unanswered,
-                score=score,
-                percentage=percentage,
-                omr_file_path=file_path,
-                processing_confidence=processing_result["confidence"]
-            )
-            db.add(result)
-        
-        db.commit()
-        db.refresh(result)
-        
-        # Log successful processing
-        log_entry = OMRProcessingLog(
-            result_id=result.id,
-            file_path=file_path,
-            processing_status="success",
-            processing_time=processing_result["processing_time"],
-            detected_bubbles={"count": processing_result["total_bubbles_detected"]},
-            confidence_scores={"overall": processing_result["confidence"]}
+        return await asyncio.to_thread(
+            save_graded_result, db, exam, current_user, existing_result,
+            file_path, file_sha256, processing_result
         )
-        db.add(log_entry)
-        db.commit()
-        
-        # Prepare response message
-        if replacing_submission:
-            message = "OMR sheet resubmitted and processed successfully. Your previous submission has been replaced."
-        else:
-            message = "OMR sheet processed successfully"
-        
-        return {
-            "message": message,
-            "result_id": result.id,
-            "score": score,
-            "percentage": round(percentage, 2),
-            "correct_answers": correct_answers,
-            "wrong_answers": wrong_answers,
-            "unanswered": unanswered,
-            "confidence": processing_result["confidence"],
-            "is_resubmission": replacing_submission
-        }
         
     except HTTPException:
         # Re-raise HTTP exceptions (like validation errors)
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except:
-                pass
+        await discard_file_async(file_path)
         raise
     except Exception as e:
         # Clean up file if processing fails
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except:
-                pass
+        await discard_file_async(file_path)
         
         # Log the full error for debugging
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"OMR Upload Error: {error_details}")
+        logger.exception("OMR upload error")
         
         raise HTTPException(
             status_code=500,
@@ -542,10 +763,7 @@ async def debug_omr_sheet(
 ):
     """Debug OMR processing to help troubleshoot detection issues."""
     # Validate exam exists
-    exam = db.query(Exam).filter(
-        Exam.exam_id == exam_id,
-        Exam.is_active == True
-    ).first()
+    exam = await asyncio.to_thread(get_exam_cached, db, exam_id)
     
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
@@ -555,31 +773,31 @@ async def debug_omr_sheet(
         raise HTTPException(status_code=400, detail="No file uploaded")
     
     file_extension = os.path.splitext(file.filename)[1].lower()
-    allowed_extensions = ['.jpg', '.jpeg', '.png', '.pdf']
     
-    if file_extension not in allowed_extensions:
+    if file_extension not in ALLOWED_FILE_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f"File format not supported. Allowed: {', '.join(allowed_extensions)}"
+            detail=f"File format not supported. Allowed: {', '.join(sorted(ALLOWED_FILE_EXTENSIONS))}"
         )
     
+    # Shed load before spending disk and CPU on the upload
+    check_omr_capacity()
+    
     # Generate unique filename for debug
     unique_filename = f"debug_{uuid.uuid4()}{file_extension}"
     file_path = os.path.join(UPLOAD_DIR, unique_filename)
     
     try:
         # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await save_upload(file, file_path)
         
         # Run debug analysis
-        debug_result = omr_processor.debug_omr_processing(
-            file_path, exam.total_questions, exam.number_of_choices
+        debug_result = await run_omr(
+            omr_processor.debug_omr_processing, file_path, exam.total_questions, exam.number_of_choices
         )
         
         # Clean up debug file
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await discard_file_async(file_path)
         
         return {
             "exam_info": {
@@ -591,10 +809,12 @@ async def debug_omr_sheet(
             "debug_analysis": debug_result
         }
         
+    except HTTPException:
+        await discard_file_async(file_path)
+        raise
     except Exception as e:
         # Clean up file if debug fails
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await discard_file_async(file_path)
         
         raise HTTPException(
             status_code=500,
@@ -602,7 +822,7 @@ async def debug_omr_sheet(
         )
 
 @app.get("/api/results/{exam_id}/{roll_number}", response_model=ResultSummary, tags=["Results"])
-async def get_result(
+def get_result(
     exam_id: str,
     roll_number: str,
     current_user: User = Depends(get_current_active_user),
@@ -610,7 +830,7 @@ async def get_result(
 ):
     """Get result for specific exam and roll number."""
     # Get exam
-    exam = db.query(Exam).filter(Exam.exam_id == exam_id).first()
+    exam = get_exam_cached(db, exam_id, active_only=False)
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
     
@@ -624,18 +844,22 @@ async def get_result(
         raise HTTPException(status_code=404, detail="Result not found")
     
     # Create answer breakdown
-    answer_breakdown = []
-    for q_num in range(1, exam.total_questions + 1):
-        q_str = str(q_num)
-        correct_answer = exam.answer_key.get(q_str, "")
-        student_answer = result.student_answers.get(q_str, "Not Answered")
-        
-        answer_breakdown.append({
+    question_ids = get_question_ids(exam.total_questions)
+    answer_key = exam.answer_key
+    student_answers = result.student_answers
+    answer_breakdown = [
+        {
             "question": q_str,
             "correct_answer": correct_answer,
             "student_answer": student_answer,
             "status": "correct" if correct_answer == student_answer else "incorrect" if student_answer != "Not Answered" else "unanswered"
-        })
+        }
+        for q_str, correct_answer, student_answer in zip(
+            question_ids,
+            [answer_key.get(q, "") for q in question_ids],
+            [student_answers.get(q, "Not Answered") for q in question_ids]
+        )
+    ]
     
     return ResultSummary(
         roll_number=result.roll_number,
@@ -652,50 +876,57 @@ async def get_result(
 
 # Teacher Dashboard endpoints
 @app.get("/api/teacher/dashboard", response_model=TeacherDashboard, tags=["Teacher"])
-async def get_teacher_dashboard(
+def get_teacher_dashboard(
     current_user: User = Depends(require_teacher),
     db: Session = Depends(get_db)
 ):
     """Get teacher dashboard data."""
+    cache_key = response_cache.dashboard_key(current_user.id)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
     try:
-        print(f"Getting dashboard for teacher ID: {current_user.id}")
-        
-        # Get total exams created by teacher
-        total_exams = db.query(Exam).filter(Exam.teacher_id == current_user.id).count()
-        print(f"Total exams: {total_exams}")
+        logger.debug("Getting dashboard for teacher ID: %s", current_user.id)
         
-        # Get total students (unique roll numbers in results for teacher's exams)
-        total_students = db.query(Result.roll_number).join(Exam).filter(
-            Exam.teacher_id == current_user.id
-        ).distinct().count()
-        print(f"Total students: {total_students}")
+        # Recent exams (last 5) come back with the teacher's totals attached
+        # as uncorrelated scalar subqueries: total exams and total students
+        # (unique roll numbers in results for teacher's exams)
+        teacher_exam = aliased(Exam)
+        total_exams_q = select(func.count(teacher_exam.id)).where(
+            teacher_exam.teacher_id == current_user.id
+        ).scalar_subquery()
+        total_students_q = select(func.count(distinct(Result.roll_number))).join(
+            teacher_exam, Result.exam_id == teacher_exam.id
+        ).where(teacher_exam.teacher_id == current_user.id).scalar_subquery()
         
-        # Get recent exams (last 5)
-        recent_exams = db.query(Exam).filter(
+        rows = db.query(Exam, total_exams_q, total_students_q).filter(
             Exam.teacher_id == current_user.id
         ).order_by(Exam.created_at.desc()).limit(5).all()
-        print(f"Recent exams count: {len(recent_exams)}")
+        recent_exams = [exam for exam, _, _ in rows]
+        total_exams, total_students = (rows[0][1], rows[0][2]) if rows else (0, 0)
+        logger.debug("Total exams: %d, total students: %d", total_exams, total_students)
         
-        # Get recent results (last 5)
+        # Get recent results (last 5); a teacher without exams has none
         recent_results = db.query(Result).join(Exam).filter(
             Exam.teacher_id == current_user.id
-        ).order_by(Result.created_at.desc()).limit(5).all()
-        print(f"Recent results count: {len(recent_results)}")
+        ).order_by(Result.created_at.desc()).limit(5).all() if rows else []
+        logger.debug("Recent results count: %d", len(recent_results))
         
-        return TeacherDashboard(
+        dashboard = TeacherDashboard(
             total_exams=total_exams,
             total_students=total_students,
             recent_exams=recent_exams,
             recent_results=recent_results
         )
+        response_cache.put(cache_key, dashboard.model_dump_json())
+        return dashboard
     except Exception as e:
-        print(f"Error in teacher dashboard: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in teacher dashboard")
         raise HTTPException(status_code=500, detail=f"Dashboard error: {str(e)}")
 
 @app.get("/api/exams/{exam_id}/statistics", response_model=ExamStatistics, tags=["Teacher"])
-async def get_exam_statistics(
+def get_exam_statistics(
     exam_id: str,
     current_user: User = Depends(require_teacher),
     db: Session = Depends(get_db)
@@ -709,66 +940,82 @@ async def get_exam_statistics(
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
     
-    # Get all results for this exam
-    results = db.query(Result).filter(Result.exam_id == exam.id).all()
+    cache_key = response_cache.statistics_key(exam.id)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
+    # Score statistics are aggregated by the database
+    total_students, average_score, highest_score, lowest_score, passed = db.query(
+        func.count(Result.id),
+        func.avg(Result.score),
+        func.max(Result.score),
+        func.min(Result.score),
+        func.sum(case((Result.score >= exam.max_marks * 0.5, 1), else_=0))
+    ).filter(Result.exam_id == exam.id).one()
     
-    if not results:
+    if not total_students:
         raise HTTPException(status_code=404, detail="No results found for this exam")
     
-    # Calculate statistics
-    scores = [result.score for result in results]
-    total_students = len(results)
-    average_score = sum(scores) / total_students
-    highest_score = max(scores)
-    lowest_score = min(scores)
-    pass_rate = len([s for s in scores if s >= (exam.max_marks * 0.5)]) / total_students * 100
-    
-    # Question-wise accuracy
-    question_wise_accuracy = {}
-    for q_num in range(1, exam.total_questions + 1):
-        q_str = str(q_num)
-        correct_count = 0
-        answered_count = 0
-        
-        for result in results:
-            if q_str in result.student_answers:
-                answered_count += 1
-                if result.student_answers[q_str] == exam.answer_key.get(q_str):
-                    correct_count += 1
-        
-        accuracy = (correct_count / answered_count * 100) if answered_count > 0 else 0
-        question_wise_accuracy[q_str] = round(accuracy, 2)
-    
-    return ExamStatistics(
+    pass_rate = passed / total_students * 100
+    
+    # Question-wise accuracy from the running per-question counts
+    question_ids = get_question_ids(exam.total_questions)
+    correct_counts, answered_counts = exam_stats.get_question_counts(
+        db, exam, question_ids, total_students
+    )
+    correct_counts = np.asarray(correct_counts, dtype=np.float64)
+    answered_counts = np.asarray(answered_counts, dtype=np.float64)
+    accuracy = np.divide(
+        correct_counts, answered_counts,
+        out=np.zeros(len(question_ids)), where=answered_counts > 0
+    ) * 100
+    question_wise_accuracy = {
+        q: round(float(value), 2) for q, value in zip(question_ids, accuracy)
+    }
+    
+    statistics = ExamStatistics(
         exam_id=exam.exam_id,
         exam_title=exam.title,
         total_students=total_students,
-        average_score=round(average_score, 2),
-        highest_score=highest_score,
-        lowest_score=lowest_score,
-        pass_rate=round(pass_rate, 2),
+        average_score=round(float(average_score), 2),
+        highest_score=float(highest_score),
+        lowest_score=float(lowest_score),
+        pass_rate=round(float(pass_rate), 2),
         question_wise_accuracy=question_wise_accuracy
     )
+    response_cache.put(cache_key, statistics.model_dump_json())
+    return statistics
 
 # Student Dashboard endpoints
 @app.get("/api/student/dashboard", response_model=StudentDashboard, tags=["Student"])
-async def get_student_dashboard(
+def get_student_dashboard(
     current_user: User = Depends(require_student),
     db: Session = Depends(get_db)
 ):
     """Get student dashboard data with exam history and results."""
+    cache_key = response_cache.dashboard_key(current_user.id)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
     try:
-        print(f"Getting dashboard for student ID: {current_user.id}")
+        logger.debug("Getting dashboard for student ID: %s", current_user.id)
         
-        # Get all results for this student with exam details
-        results_query = db.query(Result, Exam).join(Exam).filter(
+        # The last 10 results (with their exams) come back in one query, with
+        # the aggregate statistics attached as uncorrelated scalar subqueries
+        student_result = aliased(Result)
+        own_results = student_result.student_id == current_user.id
+        rows = db.query(
+            Result,
+            select(func.count(student_result.id)).where(own_results).scalar_subquery(),
+            select(func.avg(student_result.percentage)).where(own_results).scalar_subquery(),
+            select(func.max(student_result.score)).where(own_results).scalar_subquery()
+        ).join(Result.exam).options(contains_eager(Result.exam)).filter(
             Result.student_id == current_user.id
-        ).order_by(Result.created_at.desc())
-        
-        result_exam_pairs = results_query.all()
-        print(f"Found {len(result_exam_pairs)} results for student")
+        ).order_by(Result.created_at.desc()).limit(10).all()
         
-        if not result_exam_pairs:
+        if not rows:
             return StudentDashboard(
                 total_exams_taken=0,
                 average_percentage=0.0,
@@ -776,19 +1023,13 @@ async def get_student_dashboard(
                 recent_results=[]
             )
         
-        # Calculate statistics
-        all_results = [result for result, exam in result_exam_pairs]
-        total_exams_taken = len(all_results)
-        
-        percentages = [result.percentage for result in all_results]
-        scores = [result.score for result in all_results]
-        
-        average_percentage = sum(percentages) / len(percentages)
-        highest_score = max(scores)
+        latest_results = [result for result, _, _, _ in rows]
+        _, total_exams_taken, average_percentage, highest_score = rows[0]
+        logger.debug("Found %d results for student", total_exams_taken)
         
-        # Create result history (limit to last 10 results)
         recent_results = []
-        for result, exam in result_exam_pairs[:10]:
+        for result in latest_results:
+            exam = result.exam
             recent_results.append(StudentResultHistory(
                 id=result.id,
                 exam_id=exam.exam_id,
@@ -804,17 +1045,17 @@ async def get_student_dashboard(
                 created_at=result.created_at
             ))
         
-        return StudentDashboard(
+        dashboard = StudentDashboard(
             total_exams_taken=total_exams_taken,
-            average_percentage=round(average_percentage, 2),
+            average_percentage=round(float(average_percentage), 2),
             highest_score=highest_score,
             recent_results=recent_results
         )
+        response_cache.put(cache_key, dashboard.model_dump_json())
+        return dashboard
         
     except Exception as e:
-        print(f"Error in student dashboard: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in student dashboard")
         raise HTTPException(status_code=500, detail=f"Dashboard error: {str(e)}")
 
 if __name__ == "__main__":
@@ -9,6 +9,10 @@ This script will:
 3. Export data from source and import to MySQL
 4. Verify the migration
 
+With --server-side (MySQL -> MySQL on one server, or PostgreSQL ->
+PostgreSQL through postgres_fdw) step 3 runs as INSERT ... SELECT on the
+target server and no rows pass through Python or a backup file.
+
 Usage:
     python migrate_to_mysql.py --source-db <source_database_url> --target-db <mysql_database_url>
     
@@ -19,18 +23,95 @@ Example:
 import argparse
 import sys
 import os
+import tempfile
+import io
+import shutil
 from datetime import datetime
-from typing import Dict, Any, List
-import json
+from functools import cache
+from itertools import islice
+from typing import Dict, Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 
 # Add current directory to path to import our modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from sqlalchemy import create_engine, MetaData, inspect
+from sqlalchemy import (
+    create_engine, MetaData, inspect, select, event, func, literal, union_all,
+    bindparam, cast, Boolean, DateTime, Float, Integer, JSON, Text, TypeDecorator,
+)
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 import models  # Import our models
 
+try:
+    from ciso8601 import parse_datetime
+except ImportError:  # optional dependency; fromisoformat reads "Z" too on 3.11+
+    parse_datetime = datetime.fromisoformat
+
+# Order of tables for migration (to handle foreign key dependencies).
+# exam_stats is derived data; the app rebuilds it on first use.
+TABLE_CLASSES = [
+    models.User,
+    models.Exam,
+    models.Result,
+    models.OMRProcessingLog
+]
+
+# Core COUNT(*) of every migrated table, built once so each verification
+# reuses the same statement (and its cached compilation)
+TABLE_COUNTS_QUERY = union_all(*(
+    select(literal(table_class.__tablename__), func.count()).select_from(table_class.__table__)
+    for table_class in TABLE_CLASSES
+))
+
+# Rows fetched per round-trip when streaming a source table
+FETCH_BATCH_SIZE = 10000
+
+class TableBackup(NamedTuple):
+    """One table's rows saved as newline-delimited JSON"""
+    path: str
+    count: int
+
+# Rows inserted (and committed) per batch on the target
+INSERT_CHUNK_SIZE = 5000
+
+# Session statement that skips foreign key checks during the bulk load
+FK_CHECKS_OFF = {
+    "mysql": "SET FOREIGN_KEY_CHECKS=0",
+    "postgresql": "SET session_replication_role = 'replica'",  # needs superuser
+}
+
+# Session settings that relax checks and durability during the one-shot
+# bulk load; each is tried on its own and skipped if refused
+BULK_LOAD_SESSION_SETTINGS = {
+    "mysql": [
+        FK_CHECKS_OFF["mysql"],
+        "SET UNIQUE_CHECKS=0",
+    ],
+    "postgresql": [
+        FK_CHECKS_OFF["postgresql"],
+        "SET synchronous_commit = off",
+    ],
+}
+
+# Opt-in (--skip-binlog): keeps the load out of the MySQL binary log, so
+# replicas never receive the migrated rows; needs SUPER / SYSTEM_VARIABLES_ADMIN
+SKIP_BINLOG = "SET SQL_LOG_BIN=0"
+
+# Tables loaded concurrently once FK checks are off (otherwise one at a
+# time, in dependency order)
+TABLE_LOAD_WORKERS = 4
+
+# Dialects that can copy tables server-side (--server-side), and the
+# target schema the source tables are imported into on PostgreSQL
+SERVER_SIDE_DIALECTS = ("mysql", "postgresql")
+FDW_SOURCE_SCHEMA = "omr_migration_source"
+
+# Parallel index builds after the load (SQLite allows one writer)
+INDEX_BUILD_WORKERS = 4
+
 def create_database_connection(database_url: str):
     """Create database engine and session"""
     try:
@@ -44,7 +125,8 @@ def create_database_connection(database_url: str):
                 max_overflow=10,
                 pool_pre_ping=True,
                 pool_recycle=3600,
-                connect_args={"charset": "utf8mb4", "autocommit": False},
+                # local_infile enables the LOAD DATA fast path in migrate_data
+                connect_args={"charset": "utf8mb4", "autocommit": False, "local_infile": True},
                 echo=False
             )
         else:  # PostgreSQL
@@ -54,6 +136,9 @@ def create_database_connection(database_url: str):
                 max_overflow=10,
                 pool_pre_ping=True,
                 pool_recycle=300,
+                # Multi-row VALUES for the batched-insert fallback
+                executemany_mode="values_plus_batch",
+                insertmanyvalues_page_size=1000,
                 echo=False
             )
         
@@ -64,103 +149,388 @@ def create_database_connection(database_url: str):
         print(f"Error: {e}")
         return None, None
 
-def get_table_data(session, table_class) -> List[Dict[str, Any]]:
-    """Extract all data from a table"""
+@cache
+def column_names(table_class) -> Tuple[str, ...]:
+    """Column names of a model's table, in table order"""
+    return tuple(c.name for c in table_class.__table__.columns)
+
+@cache
+def datetime_column_names(table_class) -> Tuple[str, ...]:
+    """Names of a model's DateTime columns (backed up as ISO strings)"""
+    return tuple(c.name for c in table_class.__table__.columns if isinstance(c.type, DateTime))
+
+@cache
+def json_column_names(table_class) -> Tuple[str, ...]:
+    """Names of a model's JSON columns (carried through as their stored text)"""
+    return tuple(c.name for c in table_class.__table__.columns if isinstance(c.type, JSON))
+
+class IsoDateTime(TypeDecorator):
+    """DateTime that also binds the ISO strings found in the backup"""
+    impl = DateTime
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return parse_datetime(value) if isinstance(value, str) else value
+
+def get_table_data(session, table_class) -> Iterator[Dict[str, Any]]:
+    """Stream all data from a table, one dict per row"""
     try:
-        # Get all records
-        records = session.query(table_class).all()
-        
-        # Convert to dictionaries
-        data = []
-        for record in records:
-            record_dict = {}
-            for column in table_class.__table__.columns:
-                value = getattr(record, column.name)
-                # Handle datetime objects
-                if hasattr(value, 'isoformat'):
-                    value = value.isoformat()
-                record_dict[column.name] = value
-            data.append(record_dict)
-        
-        return data
+        # JSON columns are read as their stored text and written back
+        # verbatim, so they are never decoded and re-encoded in between
+        columns = [
+            cast(c, Text).label(c.name) if isinstance(c.type, JSON) else c
+            for c in table_class.__table__.columns
+        ]
+        # Stream plain rows through Core; no ORM instances or identity map.
+        # Datetimes stay as-is: orjson writes them in ISO format itself
+        stmt = select(*columns).execution_options(yield_per=FETCH_BATCH_SIZE)
+        for row in session.execute(stmt).mappings():
+            yield dict(row)
     except Exception as e:
         print(f"❌ Error extracting data from table {table_class.__tablename__}: {e}")
-        return []
+        raise
+
+def read_backup_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Lazily read rows back from a table's NDJSON backup"""
+    with open(path, 'rb') as f:
+        yield from map(orjson.loads, f)
 
-def insert_table_data(session, table_class, data: List[Dict[str, Any]]) -> bool:
+def insert_table_data(engine, table_class, rows: Iterable[Dict[str, Any]]) -> bool:
     """Insert data into a table"""
-    if not data:
-        print(f"✅ No data to insert for table {table_class.__tablename__}")
-        return True
-    
     try:
-        # Convert data back to model instances
-        instances = []
-        for record_dict in data:
-            # Handle datetime strings
-            for key, value in record_dict.items():
-                if isinstance(value, str) and 'T' in value and ':' in value:
-                    try:
-                        from datetime import datetime
-                        record_dict[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                    except:
-                        pass  # Keep as string if not a valid datetime
-            
-            instance = table_class(**record_dict)
-            instances.append(instance)
+        # JSON values are already serialized text: bind them as plain
+        # strings instead of letting the JSON type encode them again.
+        # Datetimes are ISO strings, parsed in the bind step
+        insert_stmt = table_class.__table__.insert().values({
+            **{name: bindparam(name, type_=Text) for name in json_column_names(table_class)},
+            **{name: bindparam(name, type_=IsoDateTime()) for name in datetime_column_names(table_class)},
+        })
         
-        # Bulk insert
-        session.add_all(instances)
-        session.commit()
+        # One Core executemany per chunk, committed on its own: no ORM
+        # flush, and neither memory nor transaction size grows with the table.
+        # The whole table goes through a single pooled connection
+        rows = iter(rows)
+        inserted = 0
+        with engine.connect() as connection:
+            while chunk := list(islice(rows, INSERT_CHUNK_SIZE)):
+                connection.execute(insert_stmt, chunk)
+                connection.commit()
+                inserted += len(chunk)
         
-        print(f"✅ Inserted {len(instances)} records into table {table_class.__tablename__}")
+        if inserted:
+            print(f"✅ Inserted {inserted} records into table {table_class.__tablename__}")
+        else:
+            print(f"✅ No data to insert for table {table_class.__tablename__}")
         return True
     except Exception as e:
         print(f"❌ Error inserting data into table {table_class.__tablename__}: {e}")
-        session.rollback()
         return False
 
-def backup_source_data(source_session) -> Dict[str, List[Dict[str, Any]]]:
-    """Create a backup of all source data"""
+def _quoted_field(text: str) -> str:
+    """Double-quote one CSV field"""
+    return '"' + text.replace('"', '""') + '"'
+
+def _bool_field(value) -> str:
+    return "1" if value else "0"
+
+def _text_field(value) -> str:
+    return _quoted_field(str(value))
+
+@cache
+def bulk_field_encoders(table_class) -> Tuple[Tuple[str, Any], ...]:
+    """(column name, encoder) pairs for the bulk-load CSV, picked once from the column types"""
+    encoders = []
+    for column in table_class.__table__.columns:
+        if isinstance(column.type, Boolean):
+            encode = _bool_field
+        elif isinstance(column.type, (Integer, Float)):
+            encode = str  # numbers never need quoting
+        else:
+            encode = _text_field
+        encoders.append((column.name, encode))
+    return tuple(encoders)
+
+def _write_bulk_rows(f, rows: Iterable[Dict[str, Any]], table_class, null_marker: str) -> int:
+    """Write rows in the quoted CSV layout shared by LOAD DATA and COPY; returns the row count
+    
+    None becomes the unquoted null_marker; every other value goes through
+    its column's encoder, so there is no per-value type dispatch.
+    """
+    encoders, write = bulk_field_encoders(table_class), f.write
+    count = 0
+    for record_dict in rows:
+        # join() over a list comprehension skips the generator frame per row
+        write(",".join([
+            null_marker if (value := record_dict.get(name)) is None else encode(value)
+            for name, encode in encoders
+        ]) + "\n")
+        count += 1
+    return count
+
+def load_table_data_mysql(engine, table_class, rows: Iterable[Dict[str, Any]]) -> bool:
+    """Load data into a MySQL table with LOAD DATA LOCAL INFILE.
+    
+    Returns False (after rolling back) if the server or driver refuses
+    local infile, so the caller can fall back to batched inserts.
+    """
+    table_name = table_class.__tablename__
+    col_names = column_names(table_class)
+    
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.csv', delete=False) as f:
+        infile_path = f.name
+        # Unquoted NULL is read as SQL NULL (ESCAPED BY '' disables \N)
+        count = _write_bulk_rows(f, rows, table_class, "NULL")
+    
+    if not count:
+        os.remove(infile_path)
+        print(f"✅ No data to insert for table {table_name}")
+        return True
+    
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE `{table_name}` CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' ENCLOSED BY '\"' ESCAPED BY '' "
+            "LINES TERMINATED BY '\\n' "
+            f"({', '.join(f'`{name}`' for name in col_names)})",
+            (infile_path,)
+        )
+        raw.commit()
+        print(f"✅ Loaded {count} records into table {table_name} (LOAD DATA)")
+        return True
+    except Exception as e:
+        raw.rollback()
+        print(f"⚠️  LOAD DATA unavailable for table {table_name} ({e}); using batched inserts")
+        return False
+    finally:
+        raw.close()
+        os.remove(infile_path)
+
+def load_table_data_postgres(engine, table_class, rows: Iterable[Dict[str, Any]]) -> bool:
+    """Load data into a PostgreSQL table with COPY FROM STDIN (CSV).
+    
+    Returns False (after rolling back) if the driver has no copy_expert
+    (psycopg2) or COPY fails, so the caller can fall back to batched inserts.
+    """
+    table_name = table_class.__tablename__
+    col_names = column_names(table_class)
+    
+    # CSV mode reads an unquoted empty field as NULL and "" as an empty string
+    buffer = io.StringIO()
+    count = _write_bulk_rows(buffer, rows, table_class, "")
+    buffer.seek(0)
+    if not count:
+        print(f"✅ No data to insert for table {table_name}")
+        return True
+    
+    columns = ", ".join(f'"{name}"' for name in col_names)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.copy_expert(f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        # Rows keep their source ids, so move the id sequence past them
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), MAX(id)) FROM \"{table_name}\""
+        )
+        raw.commit()
+        print(f"✅ Loaded {count} records into table {table_name} (COPY)")
+        return True
+    except Exception as e:
+        raw.rollback()
+        print(f"⚠️  COPY unavailable for table {table_name} ({e}); using batched inserts")
+        return False
+    finally:
+        raw.close()
+
+def backup_source_data(source_session, backup_dir: str = ".") -> Dict[str, TableBackup]:
+    """Stream every source table to its own NDJSON backup file"""
     print("📦 Creating backup of source database...")
     
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_data = {}
     
-    # Define the order of tables for migration (to handle foreign key dependencies)
-    table_classes = [
-        models.User,
-        models.Teacher, 
-        models.Student,
-        models.Submission,
-        models.ProcessedSubmission,
-        models.SystemAuditLog
-    ]
+    # Tables are independent reads: scan them concurrently, one session
+    # (and pooled connection) per worker since sessions are not thread-safe
+    session_factory = sessionmaker(bind=source_session.get_bind())
     
-    for table_class in table_classes:
-        print(f"  📋 Backing up {table_class.__tablename__}...")
-        data = get_table_data(source_session, table_class)
-        backup_data[table_class.__tablename__] = data
-        print(f"    ✅ {len(data)} records backed up")
+    def backup_table(table_class) -> TableBackup:
+        path = os.path.join(backup_dir, f"backup_{table_class.__tablename__}_{timestamp}.ndjson")
+        count = 0
+        # Rows go straight to disk; memory stays at one fetch batch
+        with session_factory() as session, open(path, 'wb') as f:
+            for record_dict in get_table_data(session, table_class):
+                f.write(orjson.dumps(record_dict, option=orjson.OPT_APPEND_NEWLINE))
+                count += 1
+        return TableBackup(path, count)
     
-    # Save backup to file
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_filename = f"database_backup_{timestamp}.json"
+    with ThreadPoolExecutor(max_workers=len(TABLE_CLASSES)) as executor:
+        table_backups = executor.map(backup_table, TABLE_CLASSES)
+        for table_class, table_backup in zip(TABLE_CLASSES, table_backups):
+            print(f"  📋 Backed up {table_class.__tablename__}: {table_backup.count} records -> {table_backup.path}")
+            backup_data[table_class.__tablename__] = table_backup
+    
+    print("✅ Backup saved")
+    return backup_data
+
+# Native bulk-load path per target dialect
+BULK_LOADERS = {
+    "mysql": load_table_data_mysql,
+    "postgresql": load_table_data_postgres,
+}
+
+def _sql_literal(value) -> str:
+    """Quote a value for DDL options, which take no bind parameters"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+@contextmanager
+def server_side_source(source_engine, target_engine):
+    """Make the source tables readable from the target server; yields their schema name
+    
+    MySQL reads the source database directly, so both must be on the same
+    server. PostgreSQL imports the source tables through postgres_fdw for
+    the duration of the block (needs rights to create the extension).
+    """
+    source_url = source_engine.url
+    if target_engine.dialect.name == "mysql":
+        target_url = target_engine.url
+        if (source_url.host, source_url.port) != (target_url.host, target_url.port):
+            raise ValueError("server-side MySQL migration needs source and target on the same server")
+        yield source_url.database
+        return
+    
+    schema = FDW_SOURCE_SCHEMA
+    table_names = ", ".join(table_class.__tablename__ for table_class in TABLE_CLASSES)
+    server_options = ", ".join(
+        f"{name} {_sql_literal(value)}"
+        for name, value in (("host", source_url.host), ("port", source_url.port), ("dbname", source_url.database))
+        if value is not None
+    )
+    user_options = ", ".join(
+        f"{name} {_sql_literal(value)}"
+        for name, value in (("user", source_url.username), ("password", source_url.password))
+        if value is not None
+    )
     
+    def drop_source_objects():
+        # CASCADE on the server also drops the user mapping holding the password
+        with target_engine.begin() as connection:
+            connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            connection.exec_driver_sql(f"DROP SERVER IF EXISTS {schema} CASCADE")
+    
+    # Clear anything left behind by a run that crashed or was killed, and
+    # tear down after a partial setup as well as after the copy
+    drop_source_objects()
+    try:
+        with target_engine.begin() as connection:
+            connection.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS postgres_fdw")
+            connection.exec_driver_sql(f"CREATE SERVER {schema} FOREIGN DATA WRAPPER postgres_fdw OPTIONS ({server_options})")
+            connection.exec_driver_sql(f"CREATE USER MAPPING FOR CURRENT_USER SERVER {schema} OPTIONS ({user_options})")
+            connection.exec_driver_sql(f"CREATE SCHEMA {schema}")
+            connection.exec_driver_sql(f"IMPORT FOREIGN SCHEMA public LIMIT TO ({table_names}) FROM SERVER {schema} INTO {schema}")
+        yield schema
+    finally:
+        drop_source_objects()
+
+def copy_table_server_side(target_engine, source_schema: str, table_class) -> bool:
+    """Copy one table with INSERT ... SELECT, entirely on the target server"""
+    table_name = table_class.__tablename__
+    quote = target_engine.dialect.identifier_preparer.quote
+    # Explicit column lists: the source may have added columns in another order
+    columns = ", ".join(quote(name) for name in column_names(table_class))
     try:
-        with open(backup_filename, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, indent=2, default=str)
-        print(f"✅ Backup saved to {backup_filename}")
+        with target_engine.begin() as connection:
+            result = connection.exec_driver_sql(
+                f"INSERT INTO {quote(table_name)} ({columns}) "
+                f"SELECT {columns} FROM {quote(source_schema)}.{quote(table_name)}"
+            )
+            if target_engine.dialect.name == "postgresql":
+                # Rows keep their source ids, so move the id sequence past them
+                connection.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), MAX(id)) FROM \"{table_name}\""
+                )
+        print(f"✅ Copied {result.rowcount} records into table {table_name} (server-side)")
+        return True
     except Exception as e:
-        print(f"⚠️  Could not save backup file: {e}")
+        print(f"❌ Server-side copy failed for table {table_name}: {e}")
+        return False
+
+def drop_secondary_indexes(engine) -> List:
+    """Drop non-unique indexes so the bulk load does not maintain them row by row.
     
-    return backup_data
+    Indexes leading with a foreign key column stay: MySQL refuses to drop
+    the index backing a foreign key constraint. If a drop fails, the ones
+    already dropped are rebuilt before the error is raised.
+    """
+    indexes = [
+        index
+        for table_class in TABLE_CLASSES
+        for index in table_class.__table__.indexes
+        if not index.unique and not index.expressions[0].foreign_keys
+    ]
+    dropped = []
+    try:
+        for index in indexes:
+            index.drop(bind=engine)
+            dropped.append(index)
+    except Exception:
+        create_indexes(engine, dropped)
+        raise
+    return dropped
 
-def migrate_data(source_session, target_engine, backup_data: Dict[str, List[Dict[str, Any]]]) -> bool:
-    """Migrate data from source to target database"""
-    print("🚚 Starting data migration to MySQL...")
+def create_indexes(engine, indexes: List) -> None:
+    """Rebuild dropped indexes once the data is in, several at a time"""
+    workers = 1 if engine.dialect.name == "sqlite" else INDEX_BUILD_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() surfaces the first failure
+        list(executor.map(lambda index: index.create(bind=engine), indexes))
+
+@contextmanager
+def bulk_load_session(engine, skip_binlog: bool = False):
+    """Apply the bulk-load session settings to every connection opened inside the block
+    
+    Yields the set of statements the server refused.
+    """
+    statements = list(BULK_LOAD_SESSION_SETTINGS.get(engine.dialect.name, ()))
+    if skip_binlog and engine.dialect.name == "mysql":
+        statements.append(SKIP_BINLOG)
+    refused = set()
+    if not statements:
+        yield refused
+        return
+    
+    def _apply_settings(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                    dbapi_connection.commit()
+                except Exception as e:
+                    dbapi_connection.rollback()
+                    if statement not in refused:
+                        refused.add(statement)
+                        print(f"⚠️  Skipping '{statement}': {e}")
+        finally:
+            cursor.close()
     
-    # Create target session
-    target_session = sessionmaker(bind=target_engine)()
+    # Only fresh connections get the session settings; dropping them
+    # afterwards restores the defaults for everything that follows
+    engine.dispose()
+    event.listen(engine, "connect", _apply_settings)
+    try:
+        # Connect once up front so refused settings are known before loading
+        with engine.connect():
+            pass
+        yield refused
+    finally:
+        event.remove(engine, "connect", _apply_settings)
+        engine.dispose()
+
+def migrate_data(source_session, target_engine, backup_data: Optional[Dict[str, TableBackup]],
+                 skip_binlog: bool = False) -> bool:
+    """Migrate data from source to target database (server-side when backup_data is None)"""
+    print("🚚 Starting data migration to MySQL...")
     
     try:
         # Create all tables in target database
@@ -168,62 +538,78 @@ def migrate_data(source_session, target_engine, backup_data: Dict[str, List[Dict
         models.Base.metadata.create_all(bind=target_engine)
         print("    ✅ Tables created successfully")
         
-        # Define migration order (same as backup order)
-        table_classes = [
-            models.User,
-            models.Teacher, 
-            models.Student,
-            models.Submission,
-            models.ProcessedSubmission,
-            models.SystemAuditLog
-        ]
+        print("  🧹 Dropping secondary indexes for the bulk load...")
+        dropped_indexes = drop_secondary_indexes(target_engine)
+        
+        bulk_loader = BULK_LOADERS.get(target_engine.dialect.name)
         
-        # Migrate each table
-        for table_class in table_classes:
+        def load_table(table_class) -> bool:
             table_name = table_class.__tablename__
             print(f"  📥 Migrating {table_name}...")
             
-            data = backup_data.get(table_name, [])
-            success = insert_table_data(target_session, table_class, data)
+            if source_schema is not None:
+                return copy_table_server_side(target_engine, source_schema, table_class)
             
-            if not success:
-                print(f"❌ Migration failed at table {table_name}")
-                return False
+            backup_path = backup_data[table_name].path
+            # MySQL/PostgreSQL: native bulk load, falling back to batched
+            # inserts (each pass re-reads the backup file lazily)
+            return (
+                bulk_loader is not None
+                and bulk_loader(target_engine, table_class, read_backup_rows(backup_path))
+            ) or insert_table_data(target_engine, table_class, read_backup_rows(backup_path))
+        
+        source_context = (
+            server_side_source(source_session.get_bind(), target_engine)
+            if backup_data is None else nullcontext()
+        )
+        
+        # Migrate each table; the dropped indexes are rebuilt even when a
+        # table fails, so the target never keeps its tables without them
+        try:
+            with source_context as source_schema, bulk_load_session(target_engine, skip_binlog) as refused_settings:
+                fk_statement = FK_CHECKS_OFF.get(target_engine.dialect.name)
+                fk_checks_off = fk_statement is not None and fk_statement not in refused_settings
+                # Each worker loads through its own pooled connections
+                workers = TABLE_LOAD_WORKERS if fk_checks_off else 1
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    loaded = list(executor.map(load_table, TABLE_CLASSES))
+                
+                for table_class, success in zip(TABLE_CLASSES, loaded):
+                    if not success:
+                        print(f"❌ Migration failed at table {table_class.__tablename__}")
+                        return False
+        finally:
+            print(f"  🏗️  Rebuilding {len(dropped_indexes)} indexes...")
+            try:
+                create_indexes(target_engine, dropped_indexes)
+            except Exception:
+                names = ", ".join(index.name for index in dropped_indexes)
+                print(f"    ❌ Index rebuild failed; recreate any missing of: {names}")
+                raise
+            print("    ✅ Indexes rebuilt")
         
         print("✅ All data migrated successfully!")
         return True
         
     except Exception as e:
         print(f"❌ Migration failed: {e}")
-        target_session.rollback()
         return False
-    finally:
-        target_session.close()
 
-def verify_migration(source_session, target_engine, backup_data: Dict[str, List[Dict[str, Any]]]) -> bool:
+def verify_migration(source_session, target_engine, source_counts: Dict[str, int]) -> bool:
     """Verify that migration was successful"""
     print("🔍 Verifying migration...")
     
-    target_session = sessionmaker(bind=target_engine)()
-    
     try:
-        table_classes = [
-            models.User,
-            models.Teacher, 
-            models.Student,
-            models.Submission,
-            models.ProcessedSubmission,
-            models.SystemAuditLog
-        ]
+        # Count records in target: every table in one round trip
+        with target_engine.connect() as connection:
+            target_counts = dict(connection.execute(TABLE_COUNTS_QUERY).all())
         
-        for table_class in table_classes:
+        for table_class in TABLE_CLASSES:
             table_name = table_class.__tablename__
             
-            # Count records in source (from backup)
-            source_count = len(backup_data.get(table_name, []))
-            
-            # Count records in target
-            target_count = target_session.query(table_class).count()
+            # Count records in source (from backup, or counted up front)
+            source_count = source_counts[table_name]
+            target_count = target_counts[table_name]
             
             print(f"  📊 {table_name}: Source={source_count}, Target={target_count}")
             
@@ -237,14 +623,16 @@ def verify_migration(source_session, target_engine, backup_data: Dict[str, List[
     except Exception as e:
         print(f"❌ Verification failed: {e}")
         return False
-    finally:
-        target_session.close()
 
 def main():
     parser = argparse.ArgumentParser(description='Migrate OMR Evaluator database to MySQL')
     parser.add_argument('--source-db', required=True, help='Source database URL')
     parser.add_argument('--target-db', required=True, help='Target MySQL database URL')
-    parser.add_argument('--skip-backup', action='store_true', help='Skip creating backup file')
+    parser.add_argument('--skip-backup', action='store_true', help='Do not keep the backup files (use a temporary directory)')
+    parser.add_argument('--server-side', action='store_true',
+                        help='Copy tables with INSERT ... SELECT on the target server (same-dialect MySQL/PostgreSQL only; no backup)')
+    parser.add_argument('--skip-binlog', action='store_true',
+                        help='MySQL: do not binlog the load (replicas will NOT get the data; needs SUPER / SYSTEM_VARIABLES_ADMIN)')
     
     args = parser.parse_args()
     
@@ -269,19 +657,35 @@ def main():
     print("✅ Connected to target database")
     target_session.close()  # We'll create new sessions as needed
     
+    if args.server_side and not (
+        source_engine.dialect.name == target_engine.dialect.name in SERVER_SIDE_DIALECTS
+    ):
+        print("❌ --server-side needs a MySQL -> MySQL or PostgreSQL -> PostgreSQL migration")
+        sys.exit(1)
+    
+    # The backup files also feed the migration; --skip-backup only
+    # discards them afterwards
+    backup_dir = tempfile.mkdtemp(prefix="omr_backup_") if args.skip_backup else "."
+    
     try:
-        # Step 1: Backup source data
-        backup_data = backup_source_data(source_session)
+        # Step 1: Backup source data (server-side copies skip the backup)
+        if args.server_side:
+            backup_data = None
+            source_counts = dict(source_session.execute(TABLE_COUNTS_QUERY).all())
+        else:
+            backup_data = backup_source_data(source_session, backup_dir)
+            source_counts = {name: table_backup.count for name, table_backup in backup_data.items()}
         
         # Step 2: Migrate data
-        if migrate_data(source_session, target_engine, backup_data):
+        if migrate_data(source_session, target_engine, backup_data, args.skip_binlog):
             # Step 3: Verify migration
-            if verify_migration(source_session, target_engine, backup_data):
+            if verify_migration(source_session, target_engine, source_counts):
                 print("\n🎉 Migration completed successfully!")
                 print("\n📋 Next steps:")
                 print("1. Update your .env file to use the new MySQL database URL")
                 print("2. Test your application with the new database")
-                print("3. Keep the backup file for rollback if needed")
+                if not (args.skip_backup or args.server_side):
+                    print("3. Keep the backup files for rollback if needed")
             else:
                 print("\n❌ Migration verification failed!")
                 sys.exit(1)
@@ -299,6 +703,8 @@ def main():
             source_session.close()
         if target_engine:
             target_engine.dispose()
+        if args.skip_backup:
+            shutil.rmtree(backup_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,82 +1,92 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON, ForeignKey, Boolean, Float, Index
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy import String, DateTime, Text, JSON, ForeignKey, Float, Index
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
-from sqlalchemy.dialects.postgresql import UUID
-import uuid
+from typing import List, Optional
 
-Base = declarative_base()
+from database import Base
 
 class User(Base):
     __tablename__ = "users"
     
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String(50), unique=True, index=True, nullable=False)
-    email = Column(String(100), unique=True, index=True, nullable=False)
-    hashed_password = Column(String(100), nullable=False)
-    role = Column(String(20), nullable=False, default="student")  # teacher, student
-    full_name = Column(String(100), nullable=True)
-    roll_number = Column(String(20), unique=True, index=True, nullable=True)  # Only for students, unique across all users
-    created_at = Column(DateTime, default=datetime.utcnow)
-    is_active = Column(Boolean, default=True)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    username: Mapped[str] = mapped_column(String(50), unique=True, index=True, nullable=False)
+    email: Mapped[str] = mapped_column(String(100), unique=True, index=True, nullable=False)
+    hashed_password: Mapped[str] = mapped_column(String(100), nullable=False)
+    role: Mapped[str] = mapped_column(String(20), nullable=False, default="student")  # teacher, student
+    full_name: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    roll_number: Mapped[Optional[str]] = mapped_column(String(20), unique=True, index=True, nullable=True)  # Only for students, unique across all users
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    is_active: Mapped[Optional[bool]] = mapped_column(default=True)
     
     # Relationships
-    exams_created = relationship("Exam", back_populates="teacher")
-    results = relationship("Result", back_populates="student")
+    exams_created: Mapped[List["Exam"]] = relationship("Exam", back_populates="teacher")
+    results: Mapped[List["Result"]] = relationship("Result", back_populates="student")
 
 class Exam(Base):
     __tablename__ = "exams"
     
-    id = Column(Integer, primary_key=True, index=True)
-    exam_id = Column(String(20), unique=True, index=True, nullable=False)
-    title = Column(String(200), nullable=False)
-    description = Column(Text, nullable=True)
-    teacher_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    total_questions = Column(Integer, nullable=False)
-    number_of_choices = Column(Integer, nullable=False, default=4)  # Number of choices per question (A, B, C, D or A, B, C, D, E, etc.)
-    answer_key = Column(JSON, nullable=False)  # {"1": "A", "2": "B", ...}
-    max_marks = Column(Integer, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    is_active = Column(Boolean, default=True)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    exam_id: Mapped[str] = mapped_column(String(20), unique=True, index=True, nullable=False)
+    title: Mapped[str] = mapped_column(String(200), nullable=False)
+    description: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    teacher_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    total_questions: Mapped[int] = mapped_column(nullable=False)
+    number_of_choices: Mapped[int] = mapped_column(nullable=False, default=4)  # Number of choices per question (A, B, C, D or A, B, C, D, E, etc.)
+    answer_key: Mapped[dict] = mapped_column(JSON, nullable=False)  # {"1": "A", "2": "B", ...}
+    max_marks: Mapped[int] = mapped_column(nullable=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    is_active: Mapped[Optional[bool]] = mapped_column(default=True)
     
     # Relationships
-    teacher = relationship("User", back_populates="exams_created")
-    results = relationship("Result", back_populates="exam")
+    teacher: Mapped["User"] = relationship("User", back_populates="exams_created")
+    results: Mapped[List["Result"]] = relationship("Result", back_populates="exam")
 
 class Result(Base):
     __tablename__ = "results"
     
-    id = Column(Integer, primary_key=True, index=True)
-    exam_id = Column(Integer, ForeignKey("exams.id"), nullable=False)
-    student_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    roll_number = Column(String(20), nullable=False)
-    student_answers = Column(JSON, nullable=False)  # {"1": "A", "2": "B", ...}
-    correct_answers = Column(Integer, nullable=False, default=0)
-    wrong_answers = Column(Integer, nullable=False, default=0)
-    unanswered = Column(Integer, nullable=False, default=0)
-    score = Column(Float, nullable=False, default=0.0)
-    percentage = Column(Float, nullable=False, default=0.0)
-    omr_file_path = Column(String(500), nullable=True)
-    processing_confidence = Column(Float, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id"), nullable=False)
+    student_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    roll_number: Mapped[str] = mapped_column(String(20), nullable=False)
+    student_answers: Mapped[dict] = mapped_column(JSON, nullable=False)  # {"1": "A", "2": "B", ...}
+    correct_answers: Mapped[int] = mapped_column(nullable=False, default=0)
+    wrong_answers: Mapped[int] = mapped_column(nullable=False, default=0)
+    unanswered: Mapped[int] = mapped_column(nullable=False, default=0)
+    score: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    percentage: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    omr_file_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    file_sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # hash of the uploaded sheet
+    processing_confidence: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Relationships
-    exam = relationship("Exam", back_populates="results")
-    student = relationship("User", back_populates="results")
+    # lazy="raise" forces callers to eager-load the exam explicitly (no N+1)
+    exam: Mapped["Exam"] = relationship("Exam", back_populates="results", lazy="raise")
+    student: Mapped["User"] = relationship("User", back_populates="results")
 
 class OMRProcessingLog(Base):
     __tablename__ = "omr_processing_logs"
     
-    id = Column(Integer, primary_key=True, index=True)
-    result_id = Column(Integer, ForeignKey("results.id"), nullable=True)
-    file_path = Column(String(500), nullable=False)
-    processing_status = Column(String(20), nullable=False)  # success, failed, processing
-    error_message = Column(Text, nullable=True)
-    processing_time = Column(Float, nullable=True)  # in seconds
-    detected_bubbles = Column(JSON, nullable=True)
-    confidence_scores = Column(JSON, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    result_id: Mapped[Optional[int]] = mapped_column(ForeignKey("results.id"), nullable=True)
+    file_path: Mapped[str] = mapped_column(String(500), nullable=False)
+    processing_status: Mapped[str] = mapped_column(String(20), nullable=False)  # success, failed, processing
+    error_message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    processing_time: Mapped[Optional[float]] = mapped_column(Float, nullable=True)  # in seconds
+    detected_bubbles: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    confidence_scores: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+
+class ExamStats(Base):
+    """Running per-question answer counts for an exam's results."""
+    __tablename__ = "exam_stats"
+    
+    exam_id: Mapped[int] = mapped_column(ForeignKey("exams.id", ondelete="CASCADE"), primary_key=True)
+    total_results: Mapped[int] = mapped_column(nullable=False, default=0)
+    question_correct: Mapped[list] = mapped_column(JSON, nullable=False)  # [correct count for Q1, Q2, ...]
+    question_answered: Mapped[list] = mapped_column(JSON, nullable=False)  # [answered count for Q1, Q2, ...]
+    exam_updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)  # exam version the counts match
 
 # PostgreSQL-specific indexes for better performance
 # These will be ignored by SQLite and improve PostgreSQL performance
@@ -92,9 +102,13 @@ Index('idx_exam_exam_id', Exam.exam_id)
 Index('idx_exam_teacher_id', Exam.teacher_id)
 Index('idx_exam_created_at', Exam.created_at)
 Index('idx_exam_active', Exam.is_active)
+Index('idx_exam_exam_id_active', Exam.exam_id, Exam.is_active)
+Index('idx_exam_teacher_created', Exam.teacher_id, Exam.created_at)
 
 # Index for faster result queries
 Index('idx_result_exam_student', Result.exam_id, Result.student_id)
+Index('idx_result_exam_roll', Result.exam_id, Result.roll_number)
+Index('idx_result_student_created', Result.student_id, Result.created_at)
 Index('idx_result_roll_number', Result.roll_number)
 Index('idx_result_created_at', Result.created_at)
 Index('idx_result_score', Result.score)
@@ -4,15 +4,64 @@ from PIL import Image
 import json
 import time
 from typing import Dict, List, Tuple, Optional
+from dataclasses import dataclass, fields
+from functools import lru_cache
 import os
-from pdf2image import convert_from_path
+import stat
+import string
+import fitz  # PyMuPDF
+
+# Structuring element for closing gaps in bubble outlines (built once)
+CLOSE_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+# PDF pages are rendered at 150 DPI by default: a 5 mm bubble is already
+# ~30 px across, at a quarter of the pixels of 300 DPI. Pages where too
+# few contours turn up are re-rendered once at PDF_FALLBACK_DPI.
+PDF_RENDER_DPI = 150
+PDF_FALLBACK_DPI = 300
+
+@lru_cache(maxsize=8)
+def pdf_render_matrix(dpi: int) -> fitz.Matrix:
+    """Page transform for rendering at dpi (PDF user space is 72 units per inch)."""
+    return fitz.Matrix(dpi / 72, dpi / 72)
+
+# Answer labels in choice order; a question with n options uses the first n
+CHOICE_LABELS = tuple(string.ascii_uppercase)
+
+# Largest page processed (~600 DPI A4); bubble size limits and the
+# threshold block are tuned in full-resolution pixels, so anything larger
+# is rejected before decoding rather than processed at reduced size
+MAX_IMAGE_PIXELS = 25_000_000
+
+@dataclass
+class Bubbles:
+    """Detected bubbles as parallel arrays, one entry per bubble."""
+    x: np.ndarray
+    y: np.ndarray
+    w: np.ndarray
+    h: np.ndarray
+    cx: np.ndarray
+    cy: np.ndarray
+    area: np.ndarray
+    fill_ratio: np.ndarray
+    circularity: np.ndarray
+    
+    def __len__(self) -> int:
+        return len(self.cx)
+    
+    def __getitem__(self, index) -> "Bubbles":
+        """Select bubbles by index array, boolean mask or slice."""
+        return Bubbles(*(getattr(self, f.name)[index] for f in fields(self)))
 
 class OMRProcessor:
-    def __init__(self):
+    def __init__(self, pdf_dpi: int = PDF_RENDER_DPI):
+        self.pdf_dpi = pdf_dpi
         self.confidence_threshold = 0.6
         self.bubble_min_area = 50
         self.bubble_max_area = 1500
         self.aspect_ratio_threshold = 0.3
+        self.adaptive_block_size = 11  # odd neighbourhood size for the adaptive threshold
+        self.adaptive_c = 2
         
     def process_omr_sheet(self, file_path: str, total_questions: int, number_of_choices: int = 4) -> Dict:
         """
@@ -37,18 +86,19 @@ class OMRProcessor:
             if not validate_omr_format(file_path):
                 raise ValueError(f"Unsupported file format. Please use JPG, JPEG, PNG, or PDF")
             
-            # Handle PDF files
-            if file_path.lower().endswith('.pdf'):
-                image = self._convert_pdf_to_image(file_path)
-            else:
-                image = cv2.imread(file_path)
+            image = self._load_grayscale(file_path)
             
             if image is None:
                 raise ValueError("Could not load image file. The file may be corrupted or in an unsupported format.")
             
             # Process the image
-            processed_image = self._preprocess_image(image)
-            contours = self._detect_bubbles(processed_image)
+            processed_image, contours = self._find_contours(image)
+            
+            # Too few contours on a low-DPI PDF render: re-render sharper once
+            if (len(contours) < total_questions * number_of_choices / 4
+                    and file_path.lower().endswith('.pdf') and self.pdf_dpi < PDF_FALLBACK_DPI):
+                image = self._load_grayscale(file_path, PDF_FALLBACK_DPI)
+                processed_image, contours = self._find_contours(image)
             
             if not contours:
                 raise ValueError("No bubbles detected in the image. Please check the image quality and format.")
@@ -100,38 +150,76 @@ class OMRProcessor:
                 "message": f"Error processing OMR sheet: {str(e)}"
             }
     
-    def _convert_pdf_to_image(self, pdf_path: str) -> np.ndarray:
-        """Convert PDF to image for processing."""
+    def _load_grayscale(self, file_path: str, pdf_dpi: Optional[int] = None) -> Optional[np.ndarray]:
+        """Load an image file or the first PDF page as a grayscale image."""
+        # Handle PDF files
+        if file_path.lower().endswith('.pdf'):
+            return self._convert_pdf_to_image(file_path, pdf_dpi or self.pdf_dpi)
+        # Check the pixel count from the header alone, before anything is decoded
+        try:
+            with Image.open(file_path) as header:
+                width, height = header.size
+        except Image.DecompressionBombError:
+            raise ValueError("Image dimensions are too large to process")
+        except OSError:
+            width = height = 0  # not readable by PIL; leave it to imread
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image dimensions are too large to process ({width}x{height})")
+        
+        # ANYCOLOR keeps single-channel scans as they are stored (no gray ->
+        # BGR -> gray round trip) and still applies EXIF orientation, which
+        # IMREAD_UNCHANGED would not
+        image = cv2.imread(file_path, cv2.IMREAD_ANYCOLOR)
+        if image is None or image.ndim == 2:
+            return image
+        # Convert colour sheets once here (IMREAD_GRAYSCALE would use the codec's
+        # own, slightly different, conversion and can flip borderline marks)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    
+    def _convert_pdf_to_image(self, pdf_path: str, dpi: int = PDF_RENDER_DPI) -> np.ndarray:
+        """Convert PDF to a grayscale image for processing."""
         try:
-            images = convert_from_path(pdf_path, dpi=300)
-            if not images:
-                raise ValueError("Could not convert PDF to image - no pages found")
+            # Render in-process with MuPDF: no poppler subprocess, temp
+            # files or PIL round-trip
+            with fitz.open(pdf_path) as doc:
+                if doc.page_count == 0:
+                    raise ValueError("Could not convert PDF to image - no pages found")
+                
+                # Use the first page, refusing renders too large to process
+                page = doc.load_page(0)
+                width, height = page.rect.width * dpi / 72, page.rect.height * dpi / 72
+                if width * height > MAX_IMAGE_PIXELS:
+                    raise ValueError(f"page renders at {width:.0f}x{height:.0f} pixels, too large to process")
+                pix = page.get_pixmap(matrix=pdf_render_matrix(dpi), colorspace=fitz.csRGB, alpha=False)
             
-            # Use the first page
-            pil_image = images[0]
-            return cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+            # View the pixmap's buffer directly and go RGB -> gray in one
+            # pass (same weights as BGR -> gray, no intermediate BGR copy)
+            rgb = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+            return cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
         except Exception as e:
             raise ValueError(f"PDF conversion error: {str(e)}")
     
-    def _preprocess_image(self, image: np.ndarray) -> np.ndarray:
-        """Preprocess the image for better bubble detection."""
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    def _find_contours(self, gray: np.ndarray) -> Tuple[np.ndarray, List]:
+        """Preprocess and detect; returns the binary image and its contours."""
+        processed_image = self._preprocess_image(gray)
+        return processed_image, self._detect_bubbles(processed_image)
+    
+    def _preprocess_image(self, gray: np.ndarray) -> np.ndarray:
+        """Preprocess a grayscale image for better bubble detection."""
+        # Apply Gaussian blur to reduce noise; every later stage works in
+        # place on this one buffer instead of allocating a new image per step
+        processed = cv2.GaussianBlur(gray, (5, 5), 0)
         
         # Apply adaptive threshold
-        thresh = cv2.adaptiveThreshold(
-            blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY_INV, 11, 2
+        cv2.adaptiveThreshold(
+            processed, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV, self.adaptive_block_size, self.adaptive_c, dst=processed
         )
         
         # Apply morphological operations to clean up the image
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        cleaned = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+        cv2.morphologyEx(processed, cv2.MORPH_CLOSE, CLOSE_KERNEL, dst=processed)
         
-        return cleaned
+        return processed
     
     def _detect_bubbles(self, processed_image: np.ndarray) -> List:
         """Detect potential bubble contours in the image."""
@@ -140,119 +228,107 @@ class OMRProcessor:
         )
         return contours
     
-    def _filter_bubbles(self, contours: List, image: np.ndarray) -> List[Dict]:
+    def _filter_bubbles(self, contours: List, image: np.ndarray) -> Bubbles:
         """Filter contours to identify actual bubble marks."""
-        bubbles = []
+        if not contours:
+            empty = np.empty(0)
+            return Bubbles(*([empty] * len(fields(Bubbles))))
         
-        for contour in contours:
-            # Calculate contour properties
-            area = cv2.contourArea(contour)
-            if area < self.bubble_min_area or area > self.bubble_max_area:
-                continue
-            
-            # Check if contour is roughly circular
-            perimeter = cv2.arcLength(contour, True)
-            if perimeter == 0:
-                continue
-            
-            circularity = 4 * np.pi * area / (perimeter * perimeter)
-            if circularity < 0.3:  # Not circular enough
-                continue
-            
-            # Get bounding rectangle
-            x, y, w, h = cv2.boundingRect(contour)
-            aspect_ratio = float(w) / h
-            if abs(aspect_ratio - 1.0) > self.aspect_ratio_threshold:
-                continue
-            
-            # Calculate fill ratio (how much of the bubble is filled)
-            mask = np.zeros(image.shape, dtype=np.uint8)
-            cv2.fillPoly(mask, [contour], 255)
-            filled_pixels = cv2.countNonZero(cv2.bitwise_and(image, mask))
-            total_pixels = area
-            fill_ratio = filled_pixels / total_pixels if total_pixels > 0 else 0
-            
-            bubbles.append({
-                'contour': contour,
-                'center': (x + w//2, y + h//2),
-                'area': area,
-                'fill_ratio': fill_ratio,
-                'bounding_box': (x, y, w, h),
-                'circularity': circularity
-            })
+        # Area first, for every contour: each later test only runs on the
+        # survivors of the one before, and all of them on whole arrays
+        areas = np.fromiter((cv2.contourArea(contour) for contour in contours), dtype=float, count=len(contours))
+        candidates = np.flatnonzero((areas >= self.bubble_min_area) & (areas <= self.bubble_max_area))
         
-        # Sort bubbles by position (top to bottom, left to right)
-        bubbles.sort(key=lambda b: (b['center'][1], b['center'][0]))
+        # Aspect ratio from the bounding boxes of correctly sized contours
+        boxes = np.array([cv2.boundingRect(contours[i]) for i in candidates]).reshape(-1, 4)
+        square = np.abs(boxes[:, 2] / boxes[:, 3] - 1.0) <= self.aspect_ratio_threshold
+        candidates, boxes = candidates[square], boxes[square]
         
-        return bubbles
+        # arcLength walks every contour point, so circularity comes last
+        perimeters = np.array([cv2.arcLength(contours[i], True) for i in candidates], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            circularities = 4 * np.pi * areas[candidates] / (perimeters * perimeters)
+        circular = (perimeters > 0) & (circularities >= 0.3)  # Not circular enough otherwise
+        kept, boxes = candidates[circular], boxes[circular]
+        
+        # Fill ratio (how much of the bubble is filled): paint each kept
+        # contour into a mask the size of its bounding box and count the
+        # marked pixels in that ROI only, not across the whole image
+        filled_pixels = np.empty(len(kept), dtype=np.int64)
+        for j, (i, (bx, by, bw, bh)) in enumerate(zip(kept, boxes)):
+            mask = np.zeros((bh, bw), dtype=np.uint8)
+            cv2.fillPoly(mask, [contours[i]], 255, offset=(-int(bx), -int(by)))
+            filled_pixels[j] = cv2.countNonZero(cv2.bitwise_and(image[by:by + bh, bx:bx + bw], mask))
+        
+        x, y, w, h = boxes.T
+        bubbles = Bubbles(
+            x=x, y=y, w=w, h=h,
+            cx=x + w // 2, cy=y + h // 2,
+            area=areas[kept],
+            fill_ratio=filled_pixels / areas[kept],  # area > 0: kept areas are >= bubble_min_area
+            circularity=circularities[circular],
+        )
+        
+        # Sort bubbles by position (top to bottom, left to right)
+        return bubbles[np.lexsort((bubbles.cx, bubbles.cy))]
     
-    def _extract_answers(self, bubbles: List[Dict], total_questions: int, number_of_choices: int = 4) -> Dict[str, str]:
+    def _extract_answers(self, bubbles: Bubbles, total_questions: int, number_of_choices: int = 4) -> Dict[str, str]:
         """Extract answers from detected bubbles."""
         answers = {}
         
-        if not bubbles:
+        if not len(bubbles):
             return answers
         
-        # Group bubbles by rows (questions)
-        rows = self._group_bubbles_by_rows(bubbles)
+        # Group bubbles by rows (questions), limited to the expected number of questions
+        rows = self._group_bubbles_by_rows(bubbles)[:total_questions]
+        if not rows:
+            return answers
         
-        # Generate choices based on number_of_choices (A, B, C, D for 4, A, B, C, D, E for 5, etc.)
-        choices = [chr(ord('A') + i) for i in range(number_of_choices)]
+        # Choices based on number_of_choices (A, B, C, D for 4, A, B, C, D, E for 5, etc.)
+        choices = CHOICE_LABELS[:number_of_choices]
         
-        question_num = 1
-        for row in rows[:total_questions]:  # Limit to expected number of questions
-            if not row:
-                continue
-            
-            # Sort bubbles in row by x-coordinate (left to right)
-            row.sort(key=lambda b: b['center'][0])
-            
-            # Find the most filled bubble in this row
-            max_fill_ratio = 0
-            selected_choice = None
-            
-            for i, bubble in enumerate(row[:number_of_choices]):  # Limit to configured number of choices
-                if bubble['fill_ratio'] > max_fill_ratio and bubble['fill_ratio'] > self.confidence_threshold:
-                    max_fill_ratio = bubble['fill_ratio']
-                    selected_choice = choices[i] if i < len(choices) else None
-            
-            if selected_choice:
-                answers[str(question_num)] = selected_choice
-            
-            question_num += 1
+        # Sort every row by x-coordinate (left to right) in one stable
+        # lexsort, then number the bubbles within their row
+        lengths = np.array([len(row) for row in rows])
+        row_of = np.repeat(np.arange(len(rows)), lengths)
+        indices = np.concatenate(rows)
+        order = indices[np.lexsort((bubbles.cx[indices], row_of))]
+        position = np.arange(len(order)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        
+        # Question x choice fill matrix, limited to the configured number of
+        # choices; rows with fewer bubbles are padded with -inf
+        in_range = position < number_of_choices
+        fill = np.full((len(rows), number_of_choices), -np.inf)
+        fill[row_of[in_range], position[in_range]] = bubbles.fill_ratio[order[in_range]]
         
-        return answers
+        # Most filled bubble per question (first one on ties)
+        best = fill.argmax(axis=1)
+        marked = fill[np.arange(len(rows)), best] > self.confidence_threshold
+        
+        return {
+            str(question_num): choices[choice]
+            for question_num, (choice, is_marked) in enumerate(zip(best.tolist(), marked.tolist()), start=1)
+            if is_marked
+        }
     
-    def _group_bubbles_by_rows(self, bubbles: List[Dict]) -> List[List[Dict]]:
-        """Group bubbles into rows based on y-coordinate."""
-        if not bubbles:
+    def _group_bubbles_by_rows(self, bubbles: Bubbles) -> List[np.ndarray]:
+        """Group bubbles into rows based on y-coordinate; returns an index array per row."""
+        if not len(bubbles):
             return []
         
-        rows = []
-        current_row = [bubbles[0]]
         row_threshold = 30  # pixels
+        # Bubbles are sorted by y, so a row (everything within row_threshold
+        # of its first bubble) ends where searchsorted says: one C-level
+        # binary search per row instead of a Python step per bubble
+        cy = bubbles.cy
+        row_starts = [0]
+        while (next_start := int(np.searchsorted(cy, cy[row_starts[-1]] + row_threshold, side='right'))) < len(cy):
+            row_starts.append(next_start)
         
-        for bubble in bubbles[1:]:
-            # Check if bubble is in the same row as current row
-            current_row_y = current_row[0]['center'][1]
-            bubble_y = bubble['center'][1]
-            
-            if abs(bubble_y - current_row_y) <= row_threshold:
-                current_row.append(bubble)
-            else:
-                rows.append(current_row)
-                current_row = [bubble]
-        
-        if current_row:
-            rows.append(current_row)
-        
-        return rows
+        return np.split(np.arange(len(cy)), row_starts[1:])
     
-    def _calculate_confidence(self, bubbles: List[Dict], answers: Dict[str, str], total_questions: int, number_of_choices: int) -> float:
+    def _calculate_confidence(self, bubbles: Bubbles, answers: Dict[str, str], total_questions: int, number_of_choices: int) -> float:
         """Calculate overall confidence score for the processing."""
-        if not bubbles:
-            return 0.0
-        
         # Base confidence on number of questions answered vs total bubbles
         answered_questions = len(answers)
         total_bubbles = len(bubbles)
@@ -261,12 +337,8 @@ class OMRProcessor:
             return 0.0
         
         # Calculate average fill ratio of answered bubbles
-        fill_ratios = []
-        for bubble in bubbles:
-            if bubble['fill_ratio'] > self.confidence_threshold:
-                fill_ratios.append(bubble['fill_ratio'])
-        
-        avg_fill_ratio = np.mean(fill_ratios) if fill_ratios else 0.0
+        fill_ratios = bubbles.fill_ratio[bubbles.fill_ratio > self.confidence_threshold]
+        avg_fill_ratio = float(fill_ratios.mean()) if len(fill_ratios) else 0.0
         
         # Calculate confidence based on multiple factors
         expected_bubbles = total_questions * number_of_choices
@@ -279,16 +351,12 @@ class OMRProcessor:
     def debug_omr_processing(self, file_path: str, total_questions: int, number_of_choices: int = 4) -> Dict:
         """Debug version with detailed processing information."""
         try:
-            if file_path.lower().endswith('.pdf'):
-                image = self._convert_pdf_to_image(file_path)
-            else:
-                image = cv2.imread(file_path)
+            image = self._load_grayscale(file_path)
             
             if image is None:
                 return {"error": "Could not load image"}
             
-            processed_image = self._preprocess_image(image)
-            contours = self._detect_bubbles(processed_image)
+            processed_image, contours = self._find_contours(image)
             bubbles = self._filter_bubbles(contours, processed_image)
             
             debug_info = {
@@ -297,14 +365,14 @@ class OMRProcessor:
                 "bubble_details": []
             }
             
-            for i, bubble in enumerate(bubbles):
+            for i in range(len(bubbles)):
                 debug_info["bubble_details"].append({
                     "index": i,
-                    "center": bubble['center'],
-                    "area": bubble['area'],
-                    "fill_ratio": round(bubble['fill_ratio'], 3),
-                    "circularity": round(bubble['circularity'], 3),
-                    "bounding_box": bubble['bounding_box']
+                    "center": (int(bubbles.cx[i]), int(bubbles.cy[i])),
+                    "area": float(bubbles.area[i]),
+                    "fill_ratio": round(float(bubbles.fill_ratio[i]), 3),
+                    "circularity": round(float(bubbles.circularity[i]), 3),
+                    "bounding_box": (int(bubbles.x[i]), int(bubbles.y[i]), int(bubbles.w[i]), int(bubbles.h[i]))
                 })
             
             # Group into rows for analysis
@@ -319,13 +387,13 @@ class OMRProcessor:
                     "bubbles": []
                 }
                 
-                row.sort(key=lambda b: b['center'][0])  # Sort by x-coordinate
-                for j, bubble in enumerate(row):
+                row = row[np.argsort(bubbles.cx[row], kind='stable')]  # Sort by x-coordinate
+                for j, fill_ratio in enumerate(bubbles.fill_ratio[row].tolist()):
                     row_info["bubbles"].append({
                         "position": j,
-                        "fill_ratio": round(bubble['fill_ratio'], 3),
-                        "above_min_threshold": bubble['fill_ratio'] > self.min_fill_threshold,
-                        "above_confidence_threshold": bubble['fill_ratio'] > self.confidence_threshold
+                        "fill_ratio": round(fill_ratio, 3),
+                        "above_min_threshold": fill_ratio > self.min_fill_threshold,
+                        "above_confidence_threshold": fill_ratio > self.confidence_threshold
                     })
                 
                 debug_info["row_analysis"].append(row_info)
@@ -335,6 +403,11 @@ class OMRProcessor:
         except Exception as e:
             return {"error": str(e)}
 
+def init_omr_worker() -> None:
+    """Process-pool initializer: the pool already runs one sheet per process,
+    so keep OpenCV from starting its own thread pool in each of them."""
+    cv2.setNumThreads(1)
+
 # Utility functions for testing
 def create_sample_omr_data(total_questions: int) -> Dict[str, str]:
     """Create sample OMR data for testing."""
@@ -346,27 +419,20 @@ def create_sample_omr_data(total_questions: int) -> Dict[str, str]:
     
     return answers
 
+SUPPORTED_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.pdf'})
+MAX_OMR_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+
 def validate_omr_format(file_path: str) -> bool:
     """Validate if the file is a supported OMR format."""
-    if not os.path.exists(file_path):
+    # Extension first: a pure string check, no filesystem access
+    if os.path.splitext(file_path)[1].lower() not in SUPPORTED_EXTENSIONS:
         return False
     
-    if not os.path.isfile(file_path):
-        return False
-        
-    supported_extensions = ['.jpg', '.jpeg', '.png', '.pdf']
-    file_extension = os.path.splitext(file_path)[1].lower()
-    
-    # Check file size (prevent empty or too large files)
+    # One stat covers existence, regular file and size (prevent empty or too large files)
     try:
-        file_size = os.path.getsize(file_path)
-        if file_size == 0:
-            return False
-        # Max size: 10MB
-        if file_size > 10 * 1024 * 1024:
-            return False
-    except:
+        st = os.stat(file_path)
+    except OSError:
         return False
-        
-    return file_extension in supported_extensions
+    
+    return stat.S_ISREG(st.st_mode) and 0 < st.st_size <= MAX_OMR_FILE_SIZE
 
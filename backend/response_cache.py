@@ -0,0 +1,80 @@
+"""
+Short-lived cache for serialized dashboard/statistics responses and
+exam lookups.
+
+Uses Redis when REDIS_URL is set and the redis package is installed, so
+all workers share one cache; otherwise falls back to an in-process TTL
+dict (per worker).
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from config import REDIS_URL, CACHE_TTL_SECONDS
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "omr:"
+
+_redis_client = redis.Redis.from_url(REDIS_URL) if (redis and REDIS_URL) else None
+_local: Dict[str, Tuple[float, str]] = {}
+_local_lock = threading.Lock()
+
+def dashboard_key(user_id: int) -> str:
+    return f"dash:{user_id}"
+
+def statistics_key(exam_pk: int) -> str:
+    return f"stats:{exam_pk}"
+
+def exam_key(exam_id: str) -> str:
+    return f"exam:{exam_id}"
+
+def get(key: str) -> Optional[str]:
+    """Return the cached JSON payload for key, or None on miss."""
+    if _redis_client is not None:
+        try:
+            value = _redis_client.get(KEY_PREFIX + key)
+        except redis.RedisError:
+            logger.warning("Redis unavailable, treating %s as a cache miss", key)
+            return None
+        return value.decode("utf-8") if value is not None else None
+    entry = _local.get(key)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    if expires_at < time.monotonic():
+        with _local_lock:
+            _local.pop(key, None)
+        return None
+    return value
+
+def put(key: str, value: str, ttl: int = CACHE_TTL_SECONDS) -> None:
+    """Store a JSON payload for ttl seconds."""
+    if _redis_client is not None:
+        try:
+            _redis_client.set(KEY_PREFIX + key, value, ex=ttl)
+        except redis.RedisError:
+            logger.warning("Redis unavailable, not caching %s", key)
+        return
+    with _local_lock:
+        _local[key] = (time.monotonic() + ttl, value)
+
+def invalidate(*keys: str) -> None:
+    """Drop cached payloads after a write that affects them."""
+    if not keys:
+        return
+    if _redis_client is not None:
+        try:
+            _redis_client.delete(*(KEY_PREFIX + key for key in keys))
+        except redis.RedisError:
+            logger.warning("Redis unavailable, could not invalidate %s", keys)
+        return
+    with _local_lock:
+        for key in keys:
+            _local.pop(key, None)
@@ -0,0 +1,188 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+QUESTIONS = 10
+CHOICES = 4
+KEY = {str(q + 1): "ABCD"[q % CHOICES] for q in range(QUESTIONS)}
+
+
+def sheet_png(picks) -> bytes:
+    """A small answer sheet with one filled bubble per pick (None leaves it blank)."""
+    image = np.full((60 + QUESTIONS * 50, 400), 255, np.uint8)
+    for q, pick in enumerate(picks):
+        y = 40 + q * 50
+        for c in range(CHOICES):
+            cv2.circle(image, (60 + c * 60, y), 12, 0, 2)
+        if pick is not None:
+            cv2.circle(image, (60 + pick * 60, y), 12, 0, -1)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+ALL_CORRECT = sheet_png([q % CHOICES for q in range(QUESTIONS)])
+HALF_CORRECT = sheet_png([q % CHOICES if q % 2 else (q + 1) % CHOICES for q in range(QUESTIONS)])
+SOME_BLANK = sheet_png([None if q % 3 == 0 else q % CHOICES for q in range(QUESTIONS)])
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """The API on a fresh SQLite database, with uploads under a temp directory."""
+    work = tmp_path_factory.mktemp("api")
+    saved_cwd, saved_url = os.getcwd(), os.environ.get("DATABASE_URL")
+    os.chdir(work)
+    os.environ["DATABASE_URL"] = f"sqlite:///{work}/test.db"
+    try:
+        from fastapi.testclient import TestClient
+        import main
+
+        with TestClient(main.app) as client:
+            yield main, client
+    finally:
+        os.chdir(saved_cwd)
+        if saved_url is None:
+            os.environ.pop("DATABASE_URL", None)
+        else:
+            os.environ["DATABASE_URL"] = saved_url
+
+
+def login(client, username: str, **profile) -> dict:
+    client.post("/api/auth/register", json=dict(username=username, email=f"{username}@x.com", password="p", **profile))
+    token = client.post("/api/auth/login", json=dict(username=username, password="p")).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture(scope="module")
+def users(app):
+    _, client = app
+    return (
+        login(client, "teacher", role="teacher"),
+        login(client, "student1", role="student", roll_number="R1"),
+        login(client, "student2", role="student", roll_number="R2"),
+    )
+
+
+def upload(client, headers, exam_id: str, png: bytes) -> dict:
+    response = client.post("/api/omr/upload", headers=headers, data={"exam_id": exam_id}, files={"file": ("s.png", png, "image/png")})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def stored_and_rebuilt(main, exam_id: str):
+    """The exam's stored ExamStats row (or None) and the counts rebuilt from its results."""
+    from database import _session_local
+    from models import Exam, ExamStats
+
+    with _session_local()() as db:
+        exam = db.query(Exam).filter(Exam.exam_id == exam_id).one()
+        stats = db.get(ExamStats, exam.id)
+        rebuilt = main.exam_stats.rebuild_counts(db, exam, main.get_question_ids(exam.total_questions))
+        if stats is None:
+            return None, rebuilt
+        assert stats.exam_updated_at == exam.updated_at
+        return (stats.total_results, stats.question_correct, stats.question_answered), rebuilt
+
+
+def assert_stats_current(main, exam_id: str):
+    stored, rebuilt = stored_and_rebuilt(main, exam_id)
+    assert stored == rebuilt
+
+
+def test_counts_follow_each_result_change(app, users):
+    main, client = app
+    teacher, student1, student2 = users
+    response = client.post("/api/exams/create", headers=teacher, json=dict(
+        exam_id="STATS", title="Stats", total_questions=QUESTIONS, number_of_choices=CHOICES,
+        answer_key=KEY, max_marks=QUESTIONS,
+    ))
+    assert response.status_code == 200, response.text
+
+    # First upload: there is no row yet, so the statistics read builds it
+    upload(client, student1, "STATS", ALL_CORRECT)
+    assert stored_and_rebuilt(main, "STATS")[0] is None
+    assert client.get("/api/exams/STATS/statistics", headers=teacher).status_code == 200
+    assert_stats_current(main, "STATS")
+
+    # From here on every write adjusts the stored counts in place
+    upload(client, student2, "STATS", HALF_CORRECT)
+    assert_stats_current(main, "STATS")
+
+    # Resubmission moves the old answers out and the new ones in
+    upload(client, student1, "STATS", SOME_BLANK)
+    assert_stats_current(main, "STATS")
+
+    response = client.delete("/api/omr/submission/STATS", headers=student2)
+    assert response.status_code == 200, response.text
+    assert_stats_current(main, "STATS")
+
+    statistics = client.get("/api/exams/STATS/statistics", headers=teacher).json()
+    assert statistics["total_students"] == 1
+    assert statistics["question_wise_accuracy"]["1"] == 0  # left blank
+    assert statistics["question_wise_accuracy"]["2"] == 100
+
+
+def test_answer_key_edit_leaves_stale_row_until_read(app, users):
+    main, client = app
+    teacher, student1, student2 = users
+    client.post("/api/exams/create", headers=teacher, json=dict(
+        exam_id="EDIT", title="Edit", total_questions=QUESTIONS, number_of_choices=CHOICES,
+        answer_key=KEY, max_marks=QUESTIONS,
+    ))
+    upload(client, student1, "EDIT", ALL_CORRECT)
+    client.get("/api/exams/EDIT/statistics", headers=teacher)
+    assert_stats_current(main, "EDIT")
+    stored_before = stored_and_rebuilt(main, "EDIT")[0]
+
+    # Editing the key makes the row a stale version: writes leave it alone
+    # (they would count against the wrong key) and the next read rebuilds it
+    edited_key = dict(KEY, **{"1": "B"})
+    response = client.put("/api/exams/EDIT", headers=teacher, json=dict(answer_key=edited_key))
+    assert response.status_code == 200, response.text
+    upload(client, student2, "EDIT", HALF_CORRECT)
+
+    from database import _session_local
+    from models import Exam, ExamStats
+
+    with _session_local()() as db:
+        exam = db.query(Exam).filter(Exam.exam_id == "EDIT").one()
+        stats = db.get(ExamStats, exam.id)
+        assert stats.exam_updated_at != exam.updated_at
+        assert (stats.total_results, stats.question_correct, stats.question_answered) == stored_before
+
+    assert client.get("/api/exams/EDIT/statistics", headers=teacher).status_code == 200
+    assert_stats_current(main, "EDIT")
+    stored = stored_and_rebuilt(main, "EDIT")[0]
+    assert stored[0] == 2
+    assert stored[1][0] == 1  # only HALF_CORRECT picked B for question 1
+
+
+def test_row_out_of_step_with_results_is_recounted(app, users):
+    main, client = app
+    teacher, student1, _ = users
+    client.post("/api/exams/create", headers=teacher, json=dict(
+        exam_id="DRIFT", title="Drift", total_questions=QUESTIONS, number_of_choices=CHOICES,
+        answer_key=KEY, max_marks=QUESTIONS,
+    ))
+    upload(client, student1, "DRIFT", HALF_CORRECT)
+    client.get("/api/exams/DRIFT/statistics", headers=teacher)
+
+    # Simulate a write that missed the row
+    from database import _session_local
+    from models import Exam, ExamStats
+
+    with _session_local()() as db:
+        exam = db.query(Exam).filter(Exam.exam_id == "DRIFT").one()
+        stats = db.get(ExamStats, exam.id)
+        stats.total_results = 5
+        stats.question_correct = [5] * QUESTIONS
+        db.commit()
+    main.response_cache.invalidate(main.response_cache.statistics_key(exam.id))
+
+    statistics = client.get("/api/exams/DRIFT/statistics", headers=teacher).json()
+    assert statistics["question_wise_accuracy"]["1"] == 0
+    assert_stats_current(main, "DRIFT")
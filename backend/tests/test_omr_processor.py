@@ -0,0 +1,75 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from omr_processor import MAX_IMAGE_PIXELS, OMRProcessor
+
+
+def make_sheet(seed: int, questions: int = 30, choices: int = 4, width: int = 1800, height: int = 2400):
+    """Draw a noisy synthetic answer sheet; every sixth question is left blank.
+
+    Returns the grayscale image and the answer key it was drawn with.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width), 255, np.uint8)
+    key = {}
+    for q in range(questions):
+        y = 120 + q * 70
+        pick = int(rng.integers(0, choices))
+        for c in range(choices):
+            cv2.circle(image, (200 + c * 70, y), 12, 0, 2)
+        if q % 6 != 5:
+            cv2.circle(image, (200 + pick * 70, y), 12, 0, -1)
+            key[str(q + 1)] = "ABCD"[pick]
+    noise = rng.integers(-15, 16, image.shape)
+    return np.clip(image.astype(int) + noise, 0, 255).astype(np.uint8), key
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_large_sheet_answers_match_key(tmp_path, seed):
+    # Sheets over 1500 px on both sides once went through a half-resolution
+    # pass that filled in empty bubbles and graded blank questions
+    image, key = make_sheet(seed)
+    assert min(image.shape) > 1500
+    path = str(tmp_path / "sheet.png")
+    cv2.imwrite(path, image)
+
+    result = OMRProcessor().process_omr_sheet(path, total_questions=30, number_of_choices=4)
+
+    assert result["success"], result["message"]
+    assert result["answers"] == key
+
+
+def pad_sheet(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Place image in the top-left corner of a blank width x height page."""
+    page = np.full((height, width), 255, np.uint8)
+    page[:image.shape[0], :image.shape[1]] = image
+    return page
+
+
+@pytest.mark.parametrize("width, height, graded", [
+    (4900, 5000, True),   # just inside MAX_IMAGE_PIXELS: full resolution
+    (5100, 5000, False),  # over it: refused, never graded at reduced size
+])
+def test_sheet_pixel_limit(tmp_path, width, height, graded):
+    # Oversized images used to be decoded at half size with thresholds still
+    # tuned for full resolution, which misgraded them
+    image, key = make_sheet(0)
+    assert (width * height <= MAX_IMAGE_PIXELS) == graded
+    path = str(tmp_path / "sheet.png")
+    cv2.imwrite(path, pad_sheet(image, width, height))
+
+    result = OMRProcessor().process_omr_sheet(path, total_questions=30, number_of_choices=4)
+
+    if graded:
+        assert result["success"], result["message"]
+        assert result["answers"] == key
+    else:
+        assert not result["success"]
+        assert result["answers"] == {}
+        assert "too large" in result["message"]